@@ -5,22 +5,63 @@
 # Samsung Mobile Security Team @ Samsung R&D Poland
 
 import logging
-import urllib.request
+import urllib.parse
+import http.client
+import ast
+import hashlib
 from collections import OrderedDict
 import json
 import os
+import sys
+from jsonstream import JsonStream
+
+
+# raised when the BAS server replies with an error or with data that cannot be parsed
+class BASServerError(http.client.HTTPException):
+    pass
 
 
 class BASconnector:
 
-    def __init__(self, url, product=None, version=None, build_type=None, cache_size=100000, db=None):
+    BAS = 'BAS'
+    BAS_MODULES = 'BAS_modules'
+
+    # the number of locations asked for in a single request to the BAS server
+    REQUEST_BATCH_SIZE = 64
+    REQUEST_TIMEOUT = 60
+
+    # @cache_dir: a directory for the on-disk cache of the BAS server responses
+    def __init__(self, url, product=None, version=None, build_type=None, cache_size=100000, db=None,
+                 cache_dir=None):
         self.url = url + "/"
+        cache_name = "BAS"
         if product is not None and version is not None and build_type is not None:
             self.url += "BAS_{}_{}-{}/".format(product, version, build_type)
+            cache_name = "BAS_{}_{}-{}".format(product, version, build_type)
         logging.info("Will use BAS server under {}".format(self.url))
         self.cache_size = cache_size
         self.cache = OrderedDict()
         self.db = db
+        # use the BAS server rather than the data stored in the db
+        self.remote = db is None
+        # the connection to the BAS server is kept alive between the requests
+        self.connection = None
+        self.connection_pid = None
+        self.batch_supported = True
+        # the server responses are appended to the cache file as JSON lines
+        self.cache_file = None
+        self.cache_file_loaded = False
+        # the responses loaded from (or appended to) the cache file; they are kept
+        # apart from the LRU cache above so that the cache size does not apply to them
+        self.file_cache = {}
+        if cache_dir is not None:
+            # the answers depend on the server too, not only on the product build
+            url_digest = hashlib.sha256(self.url.encode()).hexdigest()[:16]
+            self.cache_file = os.path.join(cache_dir, f"{cache_name}_{url_digest}.jsonl")
+        # module paths by module id
+        self.module_paths = []
+        # module ids (tuples) by source location
+        self.loc_index = {}
         # if self.db is not None:
         #    self.db_index = self.db.create_local_index("BAS", "loc", extra_field_name=None, cache_size=100000)
 
@@ -31,56 +72,106 @@ class BASconnector:
         if self.db is None:
             return
 
-        bas_data = {}
-        with open(json_file, "r") as rfile:
-            logging.info("Loading JSON to RAM")
-            bas_data = json.load(rfile)
+        # the same module paths repeat across many locations - we store each path
+        # once in the BAS_modules collection and refer to the modules by ids
+        mod_ids = {}
+
+        def get_mod_ids(entries):
+            ids = []
+            for e in entries:
+                if e not in mod_ids:
+                    mod_ids[e] = len(mod_ids)
+                ids.append(mod_ids[e])
+            return ids
 
-        tmp = []
-        for entry in bas_data:
-            item = {"loc": entry, "entries": bas_data[entry]}
-            tmp.append(item)
+        with open(json_file, "r") as rfile:
+            logging.info("Loading BAS data from JSON")
+            # the file is parsed incrementally and the entries are stored in the
+            # db as they are parsed
+            bas_data = JsonStream(rfile).iter_object()
+            self.db.store_many_in_collection(
+                BASconnector.BAS, ({"loc": loc, "mod_ids": get_mod_ids(entries)}
+                                   for loc, entries in bas_data))
 
-        self.db.store_many_in_collection("BAS", tmp)
-        del tmp
-        del bas_data
+        self.db.store_many_in_collection(
+            BASconnector.BAS_MODULES, [{"id": v, "path": k} for k, v in mod_ids.items()])
+        logging.info(f"Stored BAS data with {len(mod_ids)} modules")
 
         # self.db_index = self.db.create_local_index("BAS", "loc", extra_field_name=None, cache_size=100000)
 
+    # load the location -> modules index from the db
+    def create_index(self):
+        self.module_paths = []
+        self.loc_index = {}
+        if self.db is None:
+            return
+        if not self.db.collection_exists(BASconnector.BAS):
+            logging.info("No BAS data in the db - will use the BAS server")
+            self.remote = True
+            return
+
+        bas_data = self.db.create_local_index(BASconnector.BAS, "loc").get_all()
+        if self.db.collection_exists(BASconnector.BAS_MODULES):
+            modules = self.db.create_local_index(BASconnector.BAS_MODULES, "id").get_all()
+            self.module_paths = [None] * len(modules)
+            for item in modules:
+                self.module_paths[item["id"]] = sys.intern(item["path"])
+            for item in bas_data:
+                self.loc_index[item["loc"]] = tuple(item["mod_ids"])
+        else:
+            # db images with the module paths stored in each entry
+            mod_ids = {}
+            for item in bas_data:
+                ids = []
+                for e in item["entries"]:
+                    if e not in mod_ids:
+                        mod_ids[e] = len(mod_ids)
+                        self.module_paths.append(sys.intern(e))
+                    ids.append(mod_ids[e])
+                self.loc_index[item["loc"]] = tuple(ids)
+        logging.info(
+            f"BAS index created for {len(self.loc_index)} locations and {len(self.module_paths)} modules")
+
+    # -------------------------------------------------------------------------
+
+    @staticmethod
+    def _get_loc(location):
+        return os.path.abspath(location.split(":")[0])
+
+    # -------------------------------------------------------------------------
+
+    # retrieves the modules in which the given source locations are compiled;
+    # returns a list with a list of module paths for each location
+    def get_modules_for_locations(self, locations):
+        if self.remote:
+            return self._get_remote_modules_for_locations(locations)
+
+        results = []
+        for location in locations:
+            loc = BASconnector._get_loc(location)
+            mod_ids = self.loc_index.get(loc)
+            if mod_ids is None:
+                logging.warning("cannot find {} in rdm database".format(loc))
+                results.append([])
+            else:
+                results.append([self.module_paths[i] for i in mod_ids])
+        return results
+
+    # -------------------------------------------------------------------------
+
     # retrieves the module in which the source file is compiled
     def get_module_for_source_file(self, src_path, location):
-        if self.cache_size > 0 and location in self.cache:
-            return self.cache[location]
-
         # we need both location and src_path
         # this is because for functions defined in header file
         # will have location set to the header and source path set
         # to _some_ file that includes that header
         isheader = False
-        loc = os.path.abspath(location.split(":")[0])
+        loc = BASconnector._get_loc(location)
         if loc[-2:] == ".h":
             isheader = True
         logging.debug("location is {} isheader {}".format(loc, isheader))
 
-        if self.db is None:
-            request = "{}/?revdeps_for={}".format(self.url, loc)
-            contents = urllib.request.urlopen(request).read().decode('utf-8')
-            # the returned contents is a JSON dict - let's use eval to create
-            # dict object from a string
-            contents = eval(contents)
-        else:
-            contents = self.db_index[loc]
-
-        if contents is None:
-            logging.warning("cannot find {} in rdm database".format(loc))
-            return []
-
-        if self.cache_size > 0:
-            self.cache[location] = contents["entries"]
-            if len(self.cache) > self.cache_size:
-                self.cache.popitem(last=False)
-
-        return contents["entries"]
+        return self.get_modules_for_locations([location])[0]
         # max = 0
         # final_entry = ""
         # if isheader == False:
@@ -96,3 +187,185 @@ class BASconnector:
         #     return contents["entries"]
         # else:
         #     return [ final_entry ]
+
+    # -------------------------------------------------------------------------
+
+    def _get_remote_modules_for_locations(self, locations):
+        if self.cache_file is not None and not self.cache_file_loaded:
+            self._load_cache_file()
+            self.cache_file_loaded = True
+
+        locs = [BASconnector._get_loc(location) for location in locations]
+        # unique locations in the order of the first occurrence
+        missing = list(OrderedDict.fromkeys(
+            loc for loc in locs if loc not in self.cache and loc not in self.file_cache))
+
+        # a failed request raises - the results of the batches fetched before
+        # are already in the cache file
+        fetched = {}
+        for i in range(0, len(missing), BASconnector.REQUEST_BATCH_SIZE):
+            batch = {}
+            for loc, entries in self._fetch_revdeps(
+                    missing[i:i + BASconnector.REQUEST_BATCH_SIZE]).items():
+                # locations which are not found are not cached, as before
+                if entries is not None:
+                    batch[loc] = entries
+            if len(batch) > 0:
+                self._store_in_cache_file(batch)
+            fetched.update(batch)
+
+        results = []
+        for loc in locs:
+            entries = fetched.get(loc)
+            if entries is None:
+                entries = self.cache.get(loc)
+            if entries is None:
+                entries = self.file_cache.get(loc)
+            if entries is None:
+                logging.warning("cannot find {} in rdm database".format(loc))
+                results.append([])
+            else:
+                results.append(entries)
+
+        for loc, entries in fetched.items():
+            if self.cache_file is not None:
+                self.file_cache[loc] = entries
+            else:
+                self._add_to_cache(loc, entries)
+        return results
+
+    # -------------------------------------------------------------------------
+
+    def _add_to_cache(self, loc, entries):
+        if self.cache_size == 0:
+            return
+        self.cache[loc] = entries
+        self.cache.move_to_end(loc)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    # -------------------------------------------------------------------------
+
+    def _load_cache_file(self):
+        if not os.path.isfile(self.cache_file):
+            return
+        with open(self.cache_file, "r") as f:
+            for line in f:
+                try:
+                    item = json.loads(line)
+                except json.JSONDecodeError:
+                    # e.g. a line that was not completely written
+                    continue
+                entries = BASconnector._get_entries(item)
+                if entries is not None and "loc" in item:
+                    self.file_cache[item["loc"]] = entries
+        logging.info(
+            f"Loaded {len(self.file_cache)} BAS responses from {self.cache_file}")
+
+    # -------------------------------------------------------------------------
+
+    def _store_in_cache_file(self, fetched):
+        if self.cache_file is None:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_file)), exist_ok=True)
+        with open(self.cache_file, "a") as f:
+            for loc, entries in fetched.items():
+                f.write(json.dumps({"loc": loc, "entries": entries}) + "\n")
+
+    # -------------------------------------------------------------------------
+
+    def _get_connection(self):
+        # connections cannot be shared with the forked --jobs workers
+        if self.connection is None or self.connection_pid != os.getpid():
+            url = urllib.parse.urlsplit(self.url)
+            if url.scheme == "https":
+                self.connection = http.client.HTTPSConnection(
+                    url.netloc, timeout=BASconnector.REQUEST_TIMEOUT)
+            else:
+                self.connection = http.client.HTTPConnection(
+                    url.netloc if url.netloc else url.path, timeout=BASconnector.REQUEST_TIMEOUT)
+            self.connection_pid = os.getpid()
+        return self.connection
+
+    # -------------------------------------------------------------------------
+
+    def _request(self, locs):
+        url = urllib.parse.urlsplit(self.url)
+        query = urllib.parse.urlencode([("revdeps_for", loc) for loc in locs])
+        path = "{}/?{}".format(url.path, query)
+        # retry once in case the server closed the kept-alive connection
+        for attempt in range(2):
+            connection = self._get_connection()
+            try:
+                connection.request("GET", path)
+                response = connection.getresponse()
+                contents = response.read().decode('utf-8')
+                break
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                self.connection = None
+                if attempt == 1:
+                    raise
+        if response.status != 200:
+            raise BASServerError(
+                f"BAS server returned {response.status} for {len(locs)} locations")
+        try:
+            return json.loads(contents)
+        except json.JSONDecodeError:
+            pass
+        try:
+            # older servers return the dict in Python syntax
+            return ast.literal_eval(contents)
+        except (ValueError, SyntaxError) as e:
+            raise BASServerError(f"Unable to parse the BAS server reply: {e}")
+
+    # -------------------------------------------------------------------------
+
+    # ask the BAS server for the modules of the given locations;
+    # returns a dictionary: location -> module paths (None if not found);
+    # raises if the server cannot be asked - a failed lookup must not be
+    # mistaken for a location without modules
+    def _fetch_revdeps(self, locs):
+        results = {loc: None for loc in locs}
+
+        try:
+            if len(locs) > 1 and self.batch_supported:
+                # a batched response is a dict: location -> {"entries": [...]}
+                try:
+                    contents = self._request(locs)
+                except BASServerError:
+                    # e.g. an older server rejecting the request
+                    contents = None
+                if isinstance(contents, dict) and "entries" not in contents:
+                    for loc in locs:
+                        results[loc] = BASconnector._get_entries(contents.get(loc))
+                    return results
+                batch_failed = True
+            else:
+                batch_failed = False
+
+            for loc in locs:
+                results[loc] = BASconnector._get_entries(self._request([loc]))
+            # the server answers the single requests, so it must be the batched
+            # requests that it does not support
+            if batch_failed:
+                logging.info(
+                    "BAS server does not support batched requests - will request each location separately")
+                self.batch_supported = False
+        except (http.client.HTTPException, OSError) as e:
+            logging.error(f"Request to the BAS server {self.url} failed: {e}")
+            raise
+        return results
+
+    # -------------------------------------------------------------------------
+
+    # returns the module paths from a single location reply of the BAS server;
+    # a malformed reply is treated as if the location was not found
+    @staticmethod
+    def _get_entries(contents):
+        if not isinstance(contents, dict):
+            return None
+        entries = contents.get("entries")
+        if not isinstance(entries, list):
+            return None
+        return entries
@@ -9,12 +9,15 @@
 
 import subprocess
 import shutil
+import filecmp
 import json
 import logging
 import tempfile
 import argparse
 import sys
 import os
+import re
+import multiprocessing
 from datetime import datetime
 import resources
 from BASconnector import BASconnector
@@ -38,6 +41,7 @@ class File:
 
 class Engine:
     LOGFILE = "aot.log"
+    LOG_FORMAT = "%(asctime)-15s [AOT]: %(message)s (@ %(funcName)s %(filename)s:%(lineno)d)"
 
     DEFAULT_OUTPUT_DIR = 'off-target'
 
@@ -45,6 +49,10 @@ class Engine:
 
     GLOBAL_HASH_FILE = 'global.hashes'
 
+    # the ids and hashes of the items emitted in each generated file (see --update)
+    MANIFEST_FILE = 'aot_manifest.json'
+    UPDATE_DIR_SUFFIX = '.aot_update'
+
     FUNCTION_POINTER_STUB_FILE_TEMPLATE = "fptr_stub.c.template"
     FUNCTION_POINTER_STUB_FILE_SOURCE = "fptr_stub.c"
     FUNCTION_POINTER_KNOWN_FUNCS_STUB_FILE_TEMPLATE = "fptr_stub_known_funcs.c.template"
@@ -55,12 +63,22 @@ class Engine:
         self.DBJSON_FILE = "db.json"
         self.db = None
         self.genclass = {"record", "record_forward", "enum", "enum_forward"}
+        self.out_dir = Engine.DEFAULT_OUTPUT_DIR
+        self.bassconnector = None
+        self.batch = False
+        self.logname = logname
+        # the output directory updated in the --update mode
+        self.update_dir = None
+        self.reset()
+
+    # -------------------------------------------------------------------------
+
+    # clear the state gathered while generating a single off-target
+    def reset(self):
         self.functions = set()
         self._visited_calls = set()
-        self.out_dir = Engine.DEFAULT_OUTPUT_DIR
         self.defined_globals = set()
         self.random_names = set()
-        self.bassconnector = None
 
         # the set of functions with inline assembly
         self.funcs_with_asm = {}
@@ -70,13 +88,28 @@ class Engine:
         self.file_contents = {}
 
         self.casted_types = set()
-        self.logname = logname
+        self.global_hashes = []
 
     # -------------------------------------------------------------------------
 
     def init(self, args, db_frontend):
         self.out_dir = args.output_dir
         self.out_dir_abs = os.path.abspath(self.out_dir)
+        # in the batch mode the output dir is a parent directory for
+        # the per-target output directories
+        self.batch = args.batch or args.batch_file is not None
+        if args.jobs > 1 and not self.batch and not args.import_json:
+            logging.warning("The --jobs option is only used in the batch mode and during import")
+
+        if args.update and os.path.isdir(self.out_dir):
+            if self.batch:
+                # the per-target directories are updated in _generate_batch_target
+                logging.info(f"Will update the off-targets in {self.out_dir}")
+            else:
+                self.update_dir = self.out_dir
+                self.out_dir = self._begin_update(self.out_dir)
+                args.output_dir = self.out_dir
+                self.out_dir_abs = os.path.abspath(self.out_dir)
 
         # predefined_files = ["aot_replacements.h", "Makefile", "aot_lib.h", "aot_lib.c", "aot_mem_init_lib.h",
         #                     "aot_mem_init_lib.c", "aot_fuzz_lib.h", "aot_fuzz_lib.c", "aot_log.h", "aot_log.c",
@@ -87,21 +120,10 @@ class Engine:
         #                     "analyze.sh" ]
 
         # create output directory
-        # TODO: perhaps it's the job of OTGenerator to prepare the output dir and call the resource manager
-        if os.path.exists(self.out_dir):
-            msg = f"The output directory {self.out_dir} already exists!"
-            logging.error(msg)
-            with open(self.out_dir + "/" + "out_dir_error.txt", "w") as file:
-                file.write(msg)
+        if not (self.batch and args.update and os.path.isdir(self.out_dir)) and \
+                not self._create_output_dir(self.out_dir, copy_resources=not self.batch):
             return False
 
-        # create OT output directory
-        os.makedirs(self.out_dir)
-
-        # copy the predefined files
-        self.resourcemgr = resources.resourcemgr_factory(self.out_dir)
-        self.resourcemgr.copy_resources()
-
         # # copy the predefined files
         # for f in predefined_files:
         #     # https://www.blog.pythonlibrary.org/2013/10/29/python-101-how-to-find-the-path-of-a-running-script/
@@ -142,7 +164,6 @@ class Engine:
         self.dump_ids = args.dump_ids
 
         self.dump_global_hashes = args.dump_global_hashes
-        self.global_hashes = []
 
         basserver = "localhost"
         if args.config:
@@ -159,9 +180,10 @@ class Engine:
                 basserver = cfg["BASserver"]
         if not args.debug_bas:
             self.bassconnector = BASconnector(basserver,
-                                              args.product, args.version, args.build_type, db=self.db_handle)
+                                              args.product, args.version, args.build_type, db=self.db_handle,
+                                              cache_dir=args.bas_cache_dir)
         else:
-            self.bassconnector = BASconnector(basserver, db=self.db_handle)
+            self.bassconnector = BASconnector(basserver, db=self.db_handle, cache_dir=args.bas_cache_dir)
 
         self.deps = Deps(args)
         self.dbops = AotDbOps(
@@ -184,14 +206,16 @@ class Engine:
                                      args.rdm_file)
 
         self.dbops.create_indices()
+        # generate_off_target temporarily clears the asm funcs set - we keep the original
+        # one so that it can be restored before the next target in the batch mode
+        self.all_funcs_with_asm = self.dbops.all_funcs_with_asm
         self.deps._get_called_functions(self.dbops.always_inc_funcs_ids)
         logging.info(
             f"Recursively we have {len(self.dbops.always_inc_funcs_ids)} functions to include")
         # self.create_indices()
 
         # sys.exit(1)
-        self.deps.discover_type_duplicates()
-        self.deps.discover_internal_types()
+        # note: type duplicates and internal types are discovered in create_indices
 
         # if self.rdm_file is not None:
         #    self.bassconnector.import_data_to_db(self.rdm_file)
@@ -230,6 +254,272 @@ class Engine:
 
     # -------------------------------------------------------------------------
 
+    # TODO: perhaps it's the job of OTGenerator to prepare the output dir and call the resource manager
+    def _create_output_dir(self, out_dir, copy_resources=True):
+        if os.path.exists(out_dir):
+            msg = f"The output directory {out_dir} already exists!"
+            logging.error(msg)
+            with open(out_dir + "/" + "out_dir_error.txt", "w") as file:
+                file.write(msg)
+            return False
+
+        # create OT output directory
+        os.makedirs(out_dir)
+
+        if copy_resources:
+            # copy the predefined files
+            self.resourcemgr = resources.resourcemgr_factory(out_dir)
+            self.resourcemgr.copy_resources()
+
+        return True
+
+    # -------------------------------------------------------------------------
+
+    # In the --update mode the off-target is generated in a staging directory next to
+    # the existing output directory; once the generation is done, only the files whose
+    # contents changed are moved to the output directory (see _finish_update), so that
+    # the unchanged files, and the object files built from them, are left untouched.
+    # Returns the path of the staging directory.
+    def _begin_update(self, out_dir):
+        staging_dir = os.path.normpath(out_dir) + Engine.UPDATE_DIR_SUFFIX
+        if os.path.exists(staging_dir):
+            # left over by an interrupted update
+            shutil.rmtree(staging_dir)
+        logging.info(f"Will update the off-target in {out_dir} (staging directory {staging_dir})")
+        return staging_dir
+
+    # -------------------------------------------------------------------------
+
+    @staticmethod
+    def _load_manifest(out_dir):
+        try:
+            with open(f"{out_dir}/{Engine.MANIFEST_FILE}", "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    # -------------------------------------------------------------------------
+
+    @staticmethod
+    def _same_file(src, dst):
+        if os.path.islink(src):
+            return os.path.islink(dst) and os.readlink(src) == os.readlink(dst)
+        if os.path.islink(dst) or not os.path.isfile(dst):
+            return False
+        return filecmp.cmp(src, dst, shallow=False)
+
+    # -------------------------------------------------------------------------
+
+    # move the files which changed from the staging directory to the output directory
+    # and remove the generated files which are no longer a part of the off-target
+    def _finish_update(self, staging_dir, out_dir):
+        old_manifest = Engine._load_manifest(out_dir)
+        new_manifest = Engine._load_manifest(staging_dir)
+
+        updated = []
+        unchanged = 0
+        for root, dirs, names in os.walk(staging_dir):
+            rel_root = os.path.relpath(root, staging_dir)
+            dst_root = os.path.normpath(os.path.join(out_dir, rel_root))
+            os.makedirs(dst_root, exist_ok=True)
+            # symlinks to directories are moved as links as well
+            for name in names + [d for d in dirs if os.path.islink(os.path.join(root, d))]:
+                src = os.path.join(root, name)
+                dst = os.path.join(dst_root, name)
+                if Engine._same_file(src, dst):
+                    unchanged += 1
+                    continue
+                os.replace(src, dst)
+                updated.append(os.path.normpath(os.path.join(rel_root, name)))
+
+        removed = [filename for filename in old_manifest if filename not in new_manifest]
+        for filename in removed:
+            if os.path.isfile(f"{out_dir}/{filename}"):
+                os.remove(f"{out_dir}/{filename}")
+        shutil.rmtree(staging_dir)
+
+        for filename in updated:
+            if filename not in new_manifest:
+                continue
+            changed = []
+            old_items = old_manifest.get(filename, {})
+            for kind, hashes in new_manifest[filename].items():
+                old_hashes = old_items.get(kind, {})
+                changed += [f"{kind}:{id}" for id, h in hashes.items() if old_hashes.get(id) != h]
+                changed += [f"{kind}:{id}" for id in old_hashes if id not in hashes]
+            logging.info(f"AOT_UPDATED_FILE: {filename} changed items: {changed}")
+        logging.info(
+            f"AOT_UPDATE: {len(updated)} files updated, {unchanged} unchanged and {len(removed)} removed in {out_dir}")
+
+    # -------------------------------------------------------------------------
+
+    # the hashes of the given items by id; @idmaps are tried in turn for each id
+    @staticmethod
+    def _get_item_hashes(ids, idmaps):
+        hashes = {}
+        for id in sorted(ids):
+            for idmap in idmaps:
+                item = idmap[id]
+                if item is not None:
+                    hashes[str(id)] = item["hash"] if "hash" in item else None
+                    break
+        return hashes
+
+    # -------------------------------------------------------------------------
+
+    # store the ids and hashes of the functions, globals and types emitted in each
+    # of the generated source files
+    # @file_items: a dictionary: file name -> (func ids, global ids, type ids)
+    def _store_manifest(self, file_items):
+        manifest = {}
+        for filename, (funcs, globs, types) in file_items.items():
+            manifest[filename] = {
+                "funcs": Engine._get_item_hashes(funcs, [self.dbops.fnidmap, self.dbops.fdmap, self.dbops.umap]),
+                "globals": Engine._get_item_hashes(globs, [self.dbops.globalsidmap]),
+                "types": Engine._get_item_hashes(types, [self.dbops.typemap])
+            }
+        with open(f"{self.out_dir}/{Engine.MANIFEST_FILE}", "w") as file:
+            json.dump(manifest, file)
+
+    # -------------------------------------------------------------------------
+
+    # copy the config file and link the database to the output directory
+    def _copy_run_files(self, args, out_dir):
+        if args.config:
+            shutil.copy(args.config, out_dir)
+
+        if args.db:
+            abspath = os.path.abspath(args.db)
+            dbname = os.path.basename(args.db)
+            os.symlink(abspath, f"{out_dir}/{dbname}")
+
+    # -------------------------------------------------------------------------
+
+    # Switch the engine and all the generator components to a new off-target.
+    # The database, indices and all the data derived from the db are kept - only the
+    # state gathered while generating the previous target is cleared.
+    def reset_target(self, out_dir):
+        self.args.output_dir = out_dir
+        self.out_dir = out_dir
+        self.out_dir_abs = os.path.abspath(out_dir)
+
+        self.reset()
+        self.dbops.all_funcs_with_asm = self.all_funcs_with_asm
+        self.deps.reset()
+        self.cutoff.reset()
+        self.codegen.reset()
+        self.init.reset()
+        self.otgen.reset()
+
+    # -------------------------------------------------------------------------
+
+    # Get the list of targets for the batch mode. Each target is a list of function
+    # specs (the same as for --functions). Targets come from the --functions list
+    # (one target per function) and from the --batch-file (one target per line,
+    # function specs separated with whitespace, lines starting with # are ignored).
+    def _get_batch_targets(self, args):
+        targets = []
+        if args.batch:
+            for f in args.functions:
+                targets.append([f])
+
+        if args.batch_file is not None:
+            with open(args.batch_file, "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if len(line) == 0 or line.startswith("#"):
+                        continue
+                    targets.append(line.split())
+
+        return targets
+
+    # -------------------------------------------------------------------------
+
+    # Generate a number of off-targets using a single loaded database.
+    # Each target is generated in a separate subdirectory of the output directory
+    # and gets its own copy of the log.
+    # @jobs: if greater than 1, the targets are distributed among that many worker
+    #        processes; the workers are forked from the current process, so the loaded
+    #        database image and the precomputed indices are shared copy-on-write
+    def generate_batch(self, targets, depth=0, jobs=1):
+        batch_dir = self.out_dir
+        dir_names = set()
+        work = []
+        for i, target in enumerate(targets):
+            dir_name = re.sub(r"[^A-Za-z0-9_.@-]", "_", "+".join(target))
+            if dir_name in dir_names:
+                dir_name = f"{dir_name}_{i}"
+            dir_names.add(dir_name)
+            work.append((target, os.path.join(batch_dir, dir_name), depth))
+
+        logging.info(
+            f"Batch mode: going to generate {len(targets)} off-targets using {jobs} jobs")
+        failed = []
+        if jobs > 1 and len(work) > 1:
+            global _batch_engine
+            _batch_engine = self
+            ctx = multiprocessing.get_context("fork")
+            with ctx.Pool(processes=min(jobs, len(work))) as pool:
+                for i, (target, success) in enumerate(pool.imap_unordered(_generate_batch_target, work)):
+                    logging.info(
+                        f"AOT_BATCH_PROGRESS: {i + 1}/{len(work)}: {target} {'done' if success else 'failed'}")
+                    if not success:
+                        failed.append(target)
+            _batch_engine = None
+        else:
+            for i, (target, out_dir, depth) in enumerate(work):
+                logging.info(
+                    f"AOT_BATCH_TARGET: {i + 1}/{len(work)}: {target} -> {out_dir}")
+                if not self._generate_batch_target(target, out_dir, depth):
+                    failed.append(target)
+
+        self.args.output_dir = batch_dir
+        self.out_dir = batch_dir
+        self.out_dir_abs = os.path.abspath(batch_dir)
+
+        logging.info(
+            f"AOT_BATCH_DONE: generated {len(targets) - len(failed)} out of {len(targets)} off-targets")
+        for target in failed:
+            logging.error(f"AOT_BATCH_FAILED: {' '.join(target)}")
+
+        return len(failed) == 0
+
+    # -------------------------------------------------------------------------
+
+    # generate a single off-target of a batch in the given output directory
+    def _generate_batch_target(self, target, out_dir, depth):
+        update_dir = None
+        if self.args.update and os.path.isdir(out_dir):
+            update_dir = out_dir
+            out_dir = self._begin_update(out_dir)
+        self.reset_target(out_dir)
+        if not self._create_output_dir(out_dir):
+            return False
+
+        success = False
+        loghandler = logging.FileHandler(f"{out_dir}/{Engine.LOGFILE}", mode="w")
+        loghandler.setFormatter(logging.Formatter(Engine.LOG_FORMAT))
+        logging.getLogger().addHandler(loghandler)
+        try:
+            success = self.generate_off_target(list(target), depth=depth)
+        except Exception as e:
+            logging.error(f"Off-target generation failed for {target}")
+            logging.getLogger(__name__).exception(e)
+        finally:
+            logging.getLogger().removeHandler(loghandler)
+            loghandler.close()
+            self._copy_run_files(self.args, out_dir)
+
+        if update_dir is not None:
+            if success:
+                self._finish_update(out_dir, update_dir)
+            else:
+                logging.error(f"Off-target in {update_dir} not updated - see {out_dir}")
+
+        return success
+
+    # -------------------------------------------------------------------------
+
     # @depth: if 0, considers only functions from the same directory as
     #         the function of interest, if 1 consider also functions
     #         from 1 dir up, etc.
@@ -1070,6 +1360,15 @@ class Engine:
 
         # we take the Makefile from resources directory
 
+        # the items emitted in each file are stored in the manifest
+        file_items = {}
+        for file in list(files.values()) + list(static_files.values()) + list(stub_files.values()):
+            if file.filename in self.file_contents:
+                file_items[file.filename] = (file.funcs, file.globals, file.types)
+        for filename in self.file_contents:
+            if filename not in file_items:
+                file_items[filename] = ([], [], self.sources_to_types.get(filename, []))
+
         # store file contents to disk
         real_names = set()
         base_files = [ "aot.c", "aot.h" ]
@@ -1100,6 +1399,7 @@ class Engine:
                 else:
                     real_names.add(real_name)
                 dst_filename = real_name
+                file_items[dst_filename] = file_items.pop(filename)
                 del filename_to_fid[filename]
                 filename_to_fid[dst_filename] = fid
 
@@ -1108,6 +1408,7 @@ class Engine:
         
         with open(f"{self.out_dir}/file_to_fid.json", "w") as file:
             json.dump(filename_to_fid, file)
+        self._store_manifest(file_items)
 
         # try to pretty-print the files
         clang_format = shutil.which("clang-format")
@@ -1170,6 +1471,8 @@ class Engine:
             len(self.cutoff.internal_funcs))
         tmp += "Funcs count: AOT_EXT_FUNCS_COUNT: {}\n".format(
             len(self.cutoff.external_funcs))
+        tmp += "Recursive query cache: AOT_QUERY_CACHE_HITS: {} AOT_QUERY_CACHE_MISSES: {}\n".format(
+            self.db_handle.query_cache_hits, self.db_handle.query_cache_misses)
         logging.info("{}".format(tmp))
         if len(self.funcs_with_asm) > 0:
             tmp = "\n# WARNING: the functions below have inline assembly commented out:\n"
@@ -1304,10 +1607,21 @@ class Engine:
 
 # ------------------------------------------------------------------------------
 
+# the engine used by the batch mode worker processes; it is set right before the workers
+# are forked so that they inherit the loaded database
+_batch_engine = None
+
+
+def _generate_batch_target(work_item):
+    target, out_dir, depth = work_item
+    return target, _batch_engine._generate_batch_target(target, out_dir, depth)
+
+# ------------------------------------------------------------------------------
+
 
 def main():
     start_time = datetime.now()
-    FORMAT = "%(asctime)-15s [AOT]: %(message)s (@ %(funcName)s %(filename)s:%(lineno)d)"
+    FORMAT = Engine.LOG_FORMAT
     (fd, logname) = tempfile.mkstemp(dir=os.getcwd())
     logging.basicConfig(filename=logname, filemode="w",
                         level=logging.INFO, format=FORMAT, datefmt='%Y-%m-%d %H:%M:%S')
@@ -1354,6 +1668,16 @@ def main():
                              'a file please use the following syntax: function_name@file_name')
     parser.add_argument('--output-dir', default=Engine.DEFAULT_OUTPUT_DIR,
                         help="A path to the output directory (default: {})".format(Engine.DEFAULT_OUTPUT_DIR))
+    parser.add_argument('--batch', action='store_true',
+                        help='Batch mode: generate a separate off-target for each of the functions from the --functions list; ' +
+                             'the database is loaded once and each off-target is stored in a subdirectory of --output-dir')
+    parser.add_argument('--batch-file', default=None,
+                        help='Batch mode: a file with a list of targets, one target per line; a line can specify more than ' +
+                             'one function (separated with whitespace) using the --functions syntax')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Batch mode: the number of worker processes generating off-targets in parallel; ' +
+                             'the workers share the loaded database; ' +
+                             'Import: the number of worker processes creating the recursive query caches')
     co_help = 'select cut-off algorithm: ' +\
               '{} - do not cut off anything, ' +\
               '{} - cut off everything outside off-traget function\'s module, ' +\
@@ -1376,6 +1700,10 @@ def main():
                         help='a list of modules for use with the --cut-off option')
     parser.add_argument('--co-files', nargs="+", default="",
                         help='a list of files for use with the --cut-off option')
+    parser.add_argument('--co-graph', action='store_true',
+                        help='find the internal functions with a single walk over the implicit funrefs graph created ' +
+                        'during import; supported for the dirs, functions and files cut-off (without --fptr-analysis); ' +
+                        'the graph follows all type references, so it may pull in more functions than with --used-types-only')
 
     parser.add_argument('--func-stats', choices=[CutOff.FUNC_STATS_NONE, CutOff.FUNC_STATS_BASIC, CutOff.FUNC_STATS_DETAILED],
                         default=CutOff.FUNC_STATS_BASIC,
@@ -1400,6 +1728,9 @@ def main():
                              'of functions, treat this function and the functions pulled it as internal')
     parser.add_argument("--debug-bas", action='store_true',
                         help="If useds, BAS server address will not be modified with build/version/type string")
+    parser.add_argument("--bas-cache-dir", default=None,
+                        help="A directory for caching the BAS server responses between runs; " +
+                             "used when the db contains no BAS data")
     parser.add_argument("--afl", type=str, choices=['none', 'stores', 'genl_ops'], default='none',
                         help="If used, generates AFL inits for stores/genl_ops")
     parser.add_argument("--init", action='store_true',
@@ -1450,12 +1781,16 @@ def main():
                         help="When the smart init mechanism finds more than one way to initialize, do not generate other options.")
     parser.add_argument("--unroll-macro-defs", action="store_true",
                         help="When generating function code unroll all expanded code that comes from macro invocations")
+    parser.add_argument("--update", action="store_true",
+                        help="When the output directory exists, update it: only the files whose contents changed are replaced, " +
+                        "the others (and the object files built from them) are left untouched")
     parser.add_argument("--use-real-filenames", action="store_true",
                         help="When generating OT code use real file names rather than the file_<ID> scheme.")
     
     args = parser.parse_args()
     
     retcode = 0
+    generated = False
     try:
         engine = Engine(logname)
 
@@ -1467,9 +1802,12 @@ def main():
 
         sys.setrecursionlimit(10000)
 
-        funs = args.functions
-        logging.info("Will generate off-target for functions {}".format(funs))
-        engine.generate_off_target(args.functions, depth=10000)
+        if engine.batch:
+            engine.generate_batch(engine._get_batch_targets(args), depth=10000, jobs=args.jobs)
+        else:
+            funs = args.functions
+            logging.info("Will generate off-target for functions {}".format(funs))
+            generated = engine.generate_off_target(args.functions, depth=10000)
     except Exception as e:
         # thanks to https://stackoverflow.com/questions/4564559/get-exception-description-and-stack-trace-which-caused-an-exception-all-as-a-st
         logger = logging.getLogger(__name__)
@@ -1480,13 +1818,13 @@ def main():
 
         engine.deinit()
         # move the config to the output dir
-        if args.config:
-            shutil.copy(args.config, engine.out_dir)
-
-        if args.db:
-            abspath = os.path.abspath(args.db)
-            dbname = os.path.basename(args.db)
-            os.symlink(abspath, f"{engine.out_dir}/{dbname}")
+        engine._copy_run_files(args, engine.out_dir)
+        if engine.update_dir is not None:
+            if retcode == 0 and generated:
+                engine._finish_update(engine.out_dir, engine.update_dir)
+                args.output_dir = engine.out_dir = engine.update_dir
+            else:
+                logging.error(f"Off-target in {engine.update_dir} not updated - see {engine.out_dir}")
         args._get_args()
         end_time = datetime.now()
         logging.info(
@@ -35,6 +35,8 @@ class AotDbFrontend:
 
         self.query_cache = OrderedDict()
         self.query_cache_size = cache_size
+        self.query_cache_hits = 0
+        self.query_cache_misses = 0
 
         self.json_data = None
 
@@ -59,14 +61,20 @@ class AotDbFrontend:
     # The function implements import to db from a db.json file.
     # If import needs to be customized, the user can pass custom function in the constructor.
     # @json_file - the JSON file to import
+    # @item_handlers - a dictionary: collection name -> list of callables; each item of the
+    #   collection is passed to the callables as soon as it is parsed, which makes it possible
+    #   to compute derived data while the file is imported
 
-    def import_db_json(self, json_file):
+    def import_db_json(self, json_file, item_handlers=None):
         pass
 
+    # @direct_index: the field values are dense non-negative integers (e.g. ids) and
+    # lookups can be served from a table indexed directly by the field value
     def create_local_index(self, collection_name, field_name, extra_field_name=None,
-                           cache_size=0, unique=True):
+                           cache_size=0, unique=True, direct_index=False):
         return AotDbCollectionQuery(self.db[collection_name], field_name, extra_field_name,
-                                    cache_size=cache_size, field_is_unique=unique)
+                                    cache_size=cache_size, field_is_unique=unique,
+                                    direct_index=direct_index)
 
     # This method makes it possible to recursively retrieve objects from the database
     # based on some criterion. For example, starting from a function we can retrieve
@@ -93,12 +101,24 @@ class AotDbFrontend:
     def create_index(self, collection_name, field_name):
         return True
 
+    def collection_exists(self, name):
+        return False
+
     def store_in_collection(self, name, data):
         pass
 
     def store_many_in_collection(self, name, data):
         pass
 
+    # large numeric data (e.g. the recursive query cache matrices) is stored as
+    # binary arrays outside of the collections; load_array returns None if the
+    # array of the given name is not present
+    def store_array(self, name, array):
+        pass
+
+    def load_array(self, name):
+        return None
+
     # makes it possible to add backend-specific arguments for the parser
     def parse_args(self, parser):
         # We can either connect to a DB or populate DB with data imported from JSON
@@ -160,6 +180,19 @@ class AotDbCollection():
                     return item
         return None
 
+    # find all items matching any of the values in a single pass over the collection;
+    # returns a dict: value -> list of matching items
+    def find_many(self, match_to_field, values):
+        results = {}
+        if self.name in self.db:
+            for item in self.db[self.name]:
+                value = item[match_to_field]
+                if value in values:
+                    if value not in results:
+                        results[value] = []
+                    results[value].append(item)
+        return results
+
 # This class makes it possible to dynamically create DB queries to for a given
 # CollectionItem object. For example, if we wish to fetch function based on it's id
 # we create
@@ -170,7 +203,8 @@ class AotDbCollection():
 
 class AotDbCollectionQuery:
 
-    def __init__(self, collection, field, extra_field=None, cache_size=0, field_is_unique=True):
+    def __init__(self, collection, field, extra_field=None, cache_size=0, field_is_unique=True,
+                 direct_index=False):
         self.collection = collection
         self.field = field
         self.extra_field = extra_field
@@ -178,6 +212,7 @@ class AotDbCollectionQuery:
         self.field_is_unique = field_is_unique
         self.cache = OrderedDict()
         self.contains_cache = OrderedDict()
+        self.table = None
 
     def __getitem__(self, key):
         return None
@@ -185,7 +220,7 @@ class AotDbCollectionQuery:
     def __contains__(self, key):
         return False
 
-    def get_many(self, list):
+    def get_many(self, keys):
         return []
 
     def get_all(self):
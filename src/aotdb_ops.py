@@ -14,11 +14,128 @@
 
 import logging
 import json
-from scipy.sparse import csr_matrix
-from scipy.sparse.csgraph import depth_first_order
+from scipy.sparse import csr_matrix, hstack
+from scipy.sparse.csgraph import connected_components
 import numpy as np
 import os
 import random
+import multiprocessing
+
+
+# collects the edges of the graphs defined by the @match_to fields of the
+# items passed to it, one item at a time
+class GraphEdges:
+
+    def __init__(self, match_from, match_to):
+        self.match_from = match_from
+        self.match_to = match_to
+        self.row_ind = {field: [] for field in match_to}
+        self.col_ind = {field: [] for field in match_to}
+
+    def __call__(self, item):
+        item_id = item[self.match_from]
+        for field in self.match_to:
+            if field not in item:
+                continue
+            match_list = item[field]
+            if not isinstance(match_list, list):
+                match_list = [match_list]
+            self.row_ind[field].extend([item_id] * len(match_list))
+            self.col_ind[field].extend(match_list)
+
+    # returns a dictionary: field -> (row_ind, col_ind) arrays
+    def get_edges(self):
+        edges = {}
+        for field in self.match_to:
+            np_row_ind = np.array(self.row_ind[field], dtype=np.int32)
+            np_col_ind = np.array(self.col_ind[field], dtype=np.int32)
+            self.row_ind[field] = []
+            self.col_ind[field] = []
+            keep = np_col_ind >= 0
+            edges[field] = (np_row_ind[keep], np_col_ind[keep])
+        return edges
+
+
+# function pointer candidates by function id (see Deps._infer_functions) stored as
+# packed arrays: for each function id the range of its expressions, for each expression
+# the range of its candidate function ids and the range of its (UTF-8) text;
+# the entries are decoded only for the functions asked about, so that the memory use
+# depends on the size of the off-target rather than on the size of the db
+class FptrMap:
+
+    FUNCS_INDPTR = 'func_fptrs.funcs_indptr'
+    EXPRS_INDPTR = 'func_fptrs.exprs_indptr'
+    CANDIDATES = 'func_fptrs.candidates'
+    TEXT_INDPTR = 'func_fptrs.text_indptr'
+    TEXT = 'func_fptrs.text'
+
+    def __init__(self, funcs_indptr, exprs_indptr, candidates, text_indptr, text):
+        self.funcs_indptr = funcs_indptr
+        self.exprs_indptr = exprs_indptr
+        self.candidates = candidates
+        self.text_indptr = text_indptr
+        self.text = text
+        # decoded entries by function id (None if the function has none)
+        self.cache = {}
+
+    # returns a dictionary: array name -> array
+    # @fpointers: the map returned by Deps._infer_functions
+    # @size: the number of function ids
+    @staticmethod
+    def create_arrays(fpointers, size):
+        expr_counts = np.zeros(size, dtype=np.int64)
+        candidate_counts = []
+        candidates = []
+        texts = []
+        for func_id in sorted(fpointers):
+            entries = fpointers[func_id]
+            expr_counts[func_id] = len(entries)
+            for expr, fids in entries:
+                candidate_counts.append(len(fids))
+                candidates.extend(fids)
+                texts.append(expr.encode("utf-8"))
+
+        def indptr(counts):
+            return np.concatenate(([0], np.cumsum(counts, dtype=np.int64)))
+
+        return {
+            FptrMap.FUNCS_INDPTR: indptr(expr_counts),
+            FptrMap.EXPRS_INDPTR: indptr(candidate_counts),
+            FptrMap.CANDIDATES: np.array(candidates, dtype=np.int64),
+            FptrMap.TEXT_INDPTR: indptr([len(t) for t in texts]),
+            FptrMap.TEXT: np.frombuffer(b"".join(texts), dtype=np.uint8)
+        }
+
+    # returns None if the arrays are not present in the db
+    @staticmethod
+    def load(db):
+        arrays = [db.load_array(name) for name in [FptrMap.FUNCS_INDPTR, FptrMap.EXPRS_INDPTR,
+                                                   FptrMap.CANDIDATES, FptrMap.TEXT_INDPTR,
+                                                   FptrMap.TEXT]]
+        if any(array is None for array in arrays):
+            return None
+        return FptrMap(*arrays)
+
+    # the same as dict.get for the map of function pointers info:
+    # returns {"_id": func_id, "entries": [(expr, [func_id, ...]), ...]}
+    def get(self, func_id, default=None):
+        if func_id not in self.cache:
+            self.cache[func_id] = self._decode(func_id)
+        result = self.cache[func_id]
+        return default if result is None else result
+
+    def _decode(self, func_id):
+        if not 0 <= func_id < len(self.funcs_indptr) - 1:
+            return None
+        start, end = int(self.funcs_indptr[func_id]), int(self.funcs_indptr[func_id + 1])
+        if start == end:
+            return None
+        entries = []
+        for i in range(start, end):
+            expr = bytes(self.text[self.text_indptr[i]:self.text_indptr[i + 1]]).decode("utf-8")
+            fids = self.candidates[self.exprs_indptr[i]:self.exprs_indptr[i + 1]].tolist()
+            entries.append((expr, fids))
+        return {"_id": func_id, "entries": entries}
 
 
 class AotDbOps:
@@ -27,6 +144,11 @@ class AotDbOps:
     ROW_IND = 'row_ind'
     COL_IND = 'col_ind'
     MATRIX_SIZE = 'matrix_size'
+    INDPTR = 'indptr'
+    INDICES = 'indices'
+    SCC_LABELS = 'scc_labels'
+    SCC_INDPTR = 'scc_indptr'
+    SCC_INDICES = 'scc_indices'
     FUNCS_REFS = 'funcs_tree_func_refs'
     FUNCS_REFS_NO_KNOWN = 'funcs_tree_funrefs_no_known'
     FUNCS_REFS_NO_ASM = 'funcs_tree_funrefs_no_asm'
@@ -35,9 +157,17 @@ class AotDbOps:
     FUNCS_CALLS_NO_KNOWN = 'funcs_tree_calls_no_known'
     FUNCS_CALLS_NO_ASM = 'funcs_tree_calls_no_asm'
     FUNCS_CALLS_NO_KNOWN_NO_ASM = 'funcs_tree_calls_no_known_no_asm'
+    FUNCS_IMPLICIT_REFS = 'funcs_tree_implicit_funrefs'
+    FUNCS_SOURCES = 'funcs_sources'
+    FUNC_FPTRS = 'func_fptrs'
     TYPES_REFS = 'types_tree_refs'
     TYPES_USEDREFS = 'types_tree_usedrefs'
     GLOBS_GLOBALREFS = 'globs_tree_globalrefs'
+    DUP_TYPES = 'dup_types'
+    TYPE_CANONICAL = 'dup_types.canonical'
+    IDENTICAL_TYPEDEFS = 'identical_typedefs'
+    IMPLICIT_TYPES = 'implicit_types'
+    INTERNAL_TYPES = 'internal_types'
 
     # #db: AotDBFrontend instance
     def __init__(self, db, basconnector, deps, args):
@@ -45,6 +175,7 @@ class AotDbOps:
         self.version = f"{args.product}_{args.version}_{args.build_type}"
         self.include_asm = args.include_asm
         self.fptr_analysis = args.fptr_analysis
+        self.jobs = args.jobs
         self.db_type = args.db_type
 
         # global state available to external classes
@@ -77,7 +208,7 @@ class AotDbOps:
         self.all_funcs_with_asm = set()  # ids of funcs that include assembly
         self.static_funcs_map = {}       # get list of file ids by static func id
         self.builtin_funcs_ids = set()   # get a list of ids of builtin funcs
-        self.fpointer_map = {}           # get function pointers info
+        self.fpointer_map = {}           # get function pointers info by func id (dict or FptrMap)
 
         # the third group are precomputed sets which represent entire
         # recursive subtrees for certain features
@@ -95,12 +226,20 @@ class AotDbOps:
         self.funcs_tree_calls_no_known = None           # same meaning as above
         self.funcs_tree_calls_no_asm = None             # same meaning as above
         self.funcs_tree_calls_no_known_no_asm = None    # same meaning as above
+        # for a given func get its callgraph including the implicit references
+        # to functions through the types and globals it uses
+        self.funcs_tree_implicit_funrefs = None
+        # the source file id of each function id (-1 for funcdecls and unresolved funcs)
+        self.funcs_sources = None
         # for a given type get all types (ids) it depends on
         self.types_tree_refs = None
         # as above, but include only the members/types that are used in the code
         self.types_tree_usedrefs = None
         # for a given global get all globals (ids) it depends on
         self.globs_tree_globalrefs = None
+        # strongly connected component condensations of the funcs_tree_* graphs
+        # by cache matrix name (see get_cache_condensation)
+        self.condensations = {}
 
     def __getitem__(self, key):
         return self.db[key]
@@ -108,7 +247,24 @@ class AotDbOps:
     def import_aot_db(self, import_json, lib_funcs_file, always_inc_funcs_file,
                       known_funcs_file, init_file, rdm_file):
 
-        json_data = self.db.import_db_json(import_json)
+        # the graph edges and the data on builtin functions, functions with asm and static
+        # functions are collected while the db.json file is parsed, item by item
+        funcs_edges = GraphEdges(
+            "id", ["funrefs", "calls", "refs", "types", "globalrefs", "fid"])
+        types_edges = GraphEdges(
+            "id", ["refs", "usedrefs", "funrefs", "globalrefs"])
+        globs_edges = GraphEdges("id", ["globalrefs", "funrefs", "type"])
+        item_handlers = {
+            "funcs": [funcs_edges],
+            "types": [types_edges],
+            "globals": [globs_edges]
+        }
+        if known_funcs_file:
+            item_handlers["funcs"].append(self._collect_func_data)
+            item_handlers["funcdecls"] = [self._collect_builtin_func]
+            item_handlers["unresolvedfuncs"] = [self._collect_builtin_func]
+
+        json_data = self.db.import_db_json(import_json, item_handlers)
 
         # create db indices required in this function
         # get function by name
@@ -166,43 +322,10 @@ class AotDbOps:
             _fids, _funcs = self._get_funcs_from_a_text_file(known_funcs_file, only_funcs=False)
             self.known_funcs_ids |= _fids
 
-            # get builtin func ids, funcs with asm and a map of static funcs
-            logging.info("Getting builtin functions")
-            prefix = "__builtin"
-
-            # if json_data is not None:
-            #     funcs = json_data['funcs']
-            #     logging.info("using data from local json file")
-            # else:
-            funcs = self.db["funcs"]
-
-            for f in funcs:
-                n = f["name"]
-                f_id = f["id"]
-                if n.startswith(prefix):
-                    self.builtin_funcs_ids.add(f_id)
-                # get all functions with asm
-                if not self.include_asm:
-                    if self._func_contains_assembly(f):
-                        self.all_funcs_with_asm.add(f_id)
-                self.static_funcs_map[f_id] = []
-
-                if f["linkage"] == "internal":
-                    for id in f["fids"]:
-                        if id not in self.static_funcs_map[f_id]:
-                            self.static_funcs_map[f_id].append(id)
-
-            funcdecls = self.db["funcdecls"]
-            for f in funcdecls:
-                n = f["name"]
-                if n.startswith(prefix):
-                    self.builtin_funcs_ids.add(f["id"])
-
-            unresolved = self.db['unresolvedfuncs']
-            for f in unresolved:
-                n = f["name"]
-                if n.startswith(prefix):
-                    self.builtin_funcs_ids.add(f["id"])
+            # builtin func ids, funcs with asm and a map of static funcs
+            # were collected during the db.json parsing
+            logging.info(
+                f"Got {len(self.builtin_funcs_ids)} builtin functions and {len(self.all_funcs_with_asm)} functions with asm")
 
             tmp_static_funcs_map = []
             for f_id in self.static_funcs_map:
@@ -237,45 +360,70 @@ class AotDbOps:
 
         # make all recursive queries we might ever need
         logging.info("Performing recursive queries for all funcs")
-        known_asm = set()
-        known_asm |= set(self.known_funcs_ids)
-        known_asm |= set(self.all_funcs_with_asm)
-
         funcs_size = len(
             funcs) + len(json_data['funcdecls']) + len(json_data['unresolvedfuncs'])
-        self.funcs_tree_funrefs = self._create_recursive_cache(
-            funcs, funcs_size, "id", "funrefs", AotDbOps.FUNCS_REFS, set())
-        self.funcs_tree_funrefs_no_known = self._create_recursive_cache(
-            funcs, funcs_size, "id", "funrefs", AotDbOps.FUNCS_REFS_NO_KNOWN, set(self.known_funcs_ids))
-        self.funcs_tree_funrefs_no_asm = self._create_recursive_cache(
-            funcs, funcs_size, "id", "funrefs", AotDbOps.FUNCS_REFS_NO_ASM, set(self.all_funcs_with_asm))
-        self.funcs_tree_funrefs_no_known_no_asm = self._create_recursive_cache(
-            funcs, funcs_size, "id", "funrefs", AotDbOps.FUNCS_REFS_NO_KNOWN_NO_ASM, known_asm)
-        self.funcs_tree_calls = self._create_recursive_cache(
-            funcs, funcs_size, "id", "calls", AotDbOps.FUNCS_CALLS, set())
-        self.funcs_tree_calls_no_known = self._create_recursive_cache(
-            funcs, funcs_size, "id", "calls", AotDbOps.FUNCS_CALLS_NO_KNOWN, set(self.known_funcs_ids))
-        self.funcs_tree_calls_no_asm = self._create_recursive_cache(
-            funcs, funcs_size, "id", "calls", AotDbOps.FUNCS_CALLS_NO_ASM, set(self.all_funcs_with_asm))
-        self.funcs_tree_calls_no_known_no_asm = self._create_recursive_cache(
-            funcs, funcs_size, "id", "calls", AotDbOps.FUNCS_CALLS_NO_KNOWN_NO_ASM, known_asm)
-
-        self.types_tree_refs = self._create_recursive_cache(
-            types, len(types), "id", "refs", AotDbOps.TYPES_REFS, set())
-        self.types_tree_usedrefs = self._create_recursive_cache(
-            types, len(types), "id", "usedrefs", AotDbOps.TYPES_USEDREFS, set())
-        self.globs_tree_globalrefs = self._create_recursive_cache(
-            globs, len(globs), "id", "globalrefs", AotDbOps.GLOBS_GLOBALREFS, set())
+
+        # the graph edges were extracted during the db.json parsing; the cut-off
+        # variants of the call graphs are derived from the same edges by masking
+        funcs_edges = funcs_edges.get_edges()
+        types_edges = types_edges.get_edges()
+        globs_edges = globs_edges.get_edges()
+
+        known_mask = AotDbOps._get_ids_mask(self.known_funcs_ids, funcs_size)
+        asm_mask = AotDbOps._get_ids_mask(self.all_funcs_with_asm, funcs_size)
+        known_asm_mask = known_mask | asm_mask
+
+        # (attribute name, collection name, edges, graph size, cut-off mask, condense)
+        # the call graphs are queried for reachability many times - we also store their
+        # condensations so that the queries can walk the (much smaller) DAG of
+        # strongly connected components
+        graphs = [
+            ("funcs_tree_funrefs", AotDbOps.FUNCS_REFS,
+             funcs_edges["funrefs"], funcs_size, None, True),
+            ("funcs_tree_funrefs_no_known", AotDbOps.FUNCS_REFS_NO_KNOWN,
+             funcs_edges["funrefs"], funcs_size, known_mask, True),
+            ("funcs_tree_funrefs_no_asm", AotDbOps.FUNCS_REFS_NO_ASM,
+             funcs_edges["funrefs"], funcs_size, asm_mask, True),
+            ("funcs_tree_funrefs_no_known_no_asm", AotDbOps.FUNCS_REFS_NO_KNOWN_NO_ASM,
+             funcs_edges["funrefs"], funcs_size, known_asm_mask, True),
+            ("funcs_tree_calls", AotDbOps.FUNCS_CALLS,
+             funcs_edges["calls"], funcs_size, None, True),
+            ("funcs_tree_calls_no_known", AotDbOps.FUNCS_CALLS_NO_KNOWN,
+             funcs_edges["calls"], funcs_size, known_mask, True),
+            ("funcs_tree_calls_no_asm", AotDbOps.FUNCS_CALLS_NO_ASM,
+             funcs_edges["calls"], funcs_size, asm_mask, True),
+            ("funcs_tree_calls_no_known_no_asm", AotDbOps.FUNCS_CALLS_NO_KNOWN_NO_ASM,
+             funcs_edges["calls"], funcs_size, known_asm_mask, True),
+            ("types_tree_refs", AotDbOps.TYPES_REFS,
+             types_edges["refs"], len(types), None, False),
+            ("types_tree_usedrefs", AotDbOps.TYPES_USEDREFS,
+             types_edges["usedrefs"], len(types), None, False),
+            ("globs_tree_globalrefs", AotDbOps.GLOBS_GLOBALREFS,
+             globs_edges["globalrefs"], len(globs), None, False)
+        ]
+        self._create_recursive_caches(graphs)
+        self._create_implicit_funrefs_cache(
+            funcs_edges, types_edges, globs_edges, funcs_size, len(types), len(globs))
+        self._create_funcs_sources(funcs_edges["fid"], funcs_size)
+        del funcs_edges
+        del types_edges
+        del globs_edges
+        del graphs
+
+        # type duplicates and internal types do not depend on the target, but
+        # discovering them takes a full pass over all types - we do it once here
+        self._store_types_data()
 
         if self.fptr_analysis:
             # preprocess list of all possible functions assigned to function pointers
             logging.info("Pre-procesing function pointers information")
+            self.typemap = self.db.create_local_index("types", "id", extra_field_name=None,
+                                                      cache_size=100000, direct_index=True)
             fpointers = self.deps._infer_functions(json_data)
-            fpointers_for_db = [{"_id": k, "entries": v}
-                                   for k, v in fpointers.items()]
-
-            self.db.store_many_in_collection("func_fptrs", fpointers_for_db)
-            del fpointers_for_db
+            # the results are stored as packed arrays, so that at startup
+            # only the entries of the functions we ask about are decoded
+            for name, array in FptrMap.create_arrays(fpointers, funcs_size).items():
+                self.db.store_array(name, array)
             del fpointers
 
         del funcs
@@ -343,10 +491,10 @@ class AotDbOps:
                                                 cache_size=100000, unique=False)
         # get function by id
         self.fnidmap = self.db.create_local_index("funcs", "id", extra_field_name=None,
-                                                  cache_size=100000)
+                                                  cache_size=100000, direct_index=True)
         # get func decl by id
         self.fdmap = self.db.create_local_index("funcdecls", "id", extra_field_name=None,
-                                                cache_size=100000)
+                                                cache_size=100000, direct_index=True)
 
         # get func decl by name
         self.fdnmap = self.db.create_local_index("funcdecls", "name", extra_field_name=None,
@@ -354,7 +502,7 @@ class AotDbOps:
 
         # get unresolved func name by id
         self.umap = self.db.create_local_index("unresolvedfuncs", "id", extra_field_name=None,
-                                               cache_size=100000)
+                                               cache_size=100000, direct_index=True)
 
         # get unresolved func name by name
         self.unmap = self.db.create_local_index("unresolvedfuncs", "name", extra_field_name=None,
@@ -362,19 +510,19 @@ class AotDbOps:
 
         # get type by id
         self.typemap = self.db.create_local_index("types", "id", extra_field_name=None,
-                                                  cache_size=100000)
+                                                  cache_size=100000, direct_index=True)
         # get global by id
         self.globalsidmap = self.db.create_local_index("globals", "id", extra_field_name=None,
-                                                       cache_size=100000)
+                                                       cache_size=100000, direct_index=True)
         # get source name by id
         self.srcidmap = self.db.create_local_index(
-            "sources", "id", "name", cache_size=100000)
+            "sources", "id", "name", cache_size=100000, direct_index=True)
         # get source id by name
         self.srcnmap = self.db.create_local_index("sources", "name", "id", cache_size=100000,
                                                   unique=False)
         # get module name by id
         self.modidmap = self.db.create_local_index(
-            "modules", "id", "name", cache_size=100000)
+            "modules", "id", "name", cache_size=100000, direct_index=True)
         # get module id by name
         self.modnmap = self.db.create_local_index("modules", "name", "id", cache_size=100000,
                                                   unique=False)
@@ -439,9 +587,23 @@ class AotDbOps:
         # self._get_called_functions(self.always_inc_funcs_ids)
         # logging.info(f"Recursively we have {len(self.always_inc_funcs_ids)} functions to include")
 
+        if not self._load_types_data():
+            # db images created before the type data was stored
+            logging.info("Type data not found in the db - will discover it now")
+            self.deps.discover_type_duplicates()
+            self.deps.discover_internal_types()
+
         if self.fptr_analysis:
-            if self.db_type == 'ftdb':
-                # if we're using db.img
+            self.fpointer_map = FptrMap.load(self.db)
+            if self.fpointer_map is not None:
+                logging.info("Function pointers information will be loaded on demand")
+            elif self.db.collection_exists(AotDbOps.FUNC_FPTRS):
+                # db images with the function pointers information stored in a collection
+                logging.info("Loading function pointers information")
+                self.fpointer_map = {item["_id"]: item for item in
+                                     self.db.create_local_index(AotDbOps.FUNC_FPTRS, "_id").get_all()}
+            elif self.db_type == 'ftdb':
+                # db images imported without --fptr-analysis
                 logging.info("Generating function pointers information")
                 fpointers = self.deps._infer_functions(self.db.db)
                 self.fpointer_map = {k: {"_id": k, "entries": v}
@@ -452,8 +614,7 @@ class AotDbOps:
                 exit(1)
 
         self.init_data = self.db.create_local_index("init_data", "name")
-        self.bassconnector.db_index = self.db.create_local_index(
-            "BAS", "loc", extra_field_name=None, cache_size=100000)
+        self.bassconnector.create_index()
 
     # -------------------------------------------------------------------------
 
@@ -468,8 +629,21 @@ class AotDbOps:
     def _create_cache_matrix(self, db, collection_name):
         logging.info(
             f"Generating cache matrix for collection {collection_name}")
+        # the matrices are stored as binary arrays in CSR format - they are
+        # memory-mapped and used by the csr_matrix object as they are
+        np_data = self.db.load_array(f"{collection_name}.{AotDbOps.DATA}")
+        if np_data is not None:
+            np_indices = self.db.load_array(f"{collection_name}.{AotDbOps.INDICES}")
+            np_indptr = self.db.load_array(f"{collection_name}.{AotDbOps.INDPTR}")
+            size = np_indptr.size - 1
+            return csr_matrix((np_data, np_indices, np_indptr), shape=(size, size), copy=False)
+
+        # db images created before the matrices were stored as binary arrays
         index = self.db.create_local_index(collection_name, "name")
         data = index[AotDbOps.DATA]
+        if data is None:
+            logging.info(f"Cache matrix {collection_name} not found in the db")
+            return None
         row_ind = index[AotDbOps.ROW_IND]
         col_ind = index[AotDbOps.COL_IND]
         np_data = np.array(data["data"])
@@ -484,60 +658,379 @@ class AotDbOps:
 
     # -------------------------------------------------------------------------
 
-    def _create_recursive_cache(self, _items, size, match_from, match_to, collection_name, cutoff=set()):
+    # returns the strongly connected component condensation of a cache matrix
+    # as a tuple (labels, dag, members_ptr, members):
+    # labels[id] is the component of id, dag is the CSR matrix of the components
+    # graph and members[members_ptr[c]:members_ptr[c + 1]] are the ids in component c
+    def get_cache_condensation(self, name):
+        if name not in self.condensations:
+            self.condensations[name] = self._create_cache_condensation(name)
+        return self.condensations[name]
 
-        logging.info(f"Graph size is {size}")
+    # -------------------------------------------------------------------------
 
-        data = []
-        row_ind = []
-        col_ind = []
-        ids = []
-        for item in _items:
-            item_id = item[match_from]
-            if cutoff and item_id in cutoff:
-                continue
-            ids.append(item_id)
-            if match_to not in item:
-                continue
-            match_list = item[match_to]
-            for _id in match_list:
-                if cutoff and _id in cutoff:
-                    continue
-                if _id < 0:
-                    continue
-                row_ind.append(item_id)
-                col_ind.append(_id)
-                if _id == item_id:
-                    # self cycles counted as 2
-                    data.append(2)
-                else:
-                    data.append(1)
-        np_data = np.array(data)
-        np_row_ind = np.array(row_ind)
-        np_col_ind = np.array(col_ind)
-        matrix = csr_matrix(
-            (np_data, (np_row_ind, np_col_ind)), shape=(size, size))
-        logging.info("Matrix created")
-        # need to break the matrix data into 3 due to the mongo limit of a single document size
-        self.db.store_in_collection(
-            collection_name, {"name": AotDbOps.DATA, "data": data})
-        self.db.store_in_collection(
-            collection_name, {"name": AotDbOps.ROW_IND, "data": row_ind})
-        self.db.store_in_collection(
-            collection_name, {"name": AotDbOps.COL_IND, "data": col_ind})
-        self.db.store_in_collection(
-            collection_name, {"name": AotDbOps.MATRIX_SIZE, "data": size})
+    def _create_cache_condensation(self, collection_name):
+        labels = self.db.load_array(f"{collection_name}.{AotDbOps.SCC_LABELS}")
+        if labels is None:
+            # db images created before the condensations were stored
+            logging.info(
+                f"Computing condensation for collection {collection_name}")
+            labels, dag = AotDbOps._condense_graph(
+                self.get_cache_matrix(collection_name))
+        else:
+            logging.info(
+                f"Loading condensation for collection {collection_name}")
+            indptr = self.db.load_array(f"{collection_name}.{AotDbOps.SCC_INDPTR}")
+            indices = self.db.load_array(f"{collection_name}.{AotDbOps.SCC_INDICES}")
+            size = indptr.size - 1
+            dag = csr_matrix((np.ones(indices.size, dtype=bool), indices, indptr),
+                             shape=(size, size), copy=False)
+
+        members = np.argsort(labels, kind="stable")
+        members_ptr = np.zeros(dag.shape[0] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(labels, minlength=dag.shape[0]), out=members_ptr[1:])
+        return labels, dag, members_ptr, members
+
+    # -------------------------------------------------------------------------
+
+    # compute the strongly connected components of a graph;
+    # returns the component label of each node and the CSR matrix of the DAG
+    # of the components
+    @staticmethod
+    def _condense_graph(matrix):
+        size, labels = connected_components(
+            matrix, directed=True, connection="strong")
+        labels = labels.astype(np.int32)
+        coo = matrix.tocoo()
+        row_ind = labels[coo.row]
+        col_ind = labels[coo.col]
+        keep = row_ind != col_ind
+        row_ind = row_ind[keep]
+        col_ind = col_ind[keep]
+        dag = csr_matrix((np.ones(row_ind.size, dtype=bool),
+                          (row_ind, col_ind)), shape=(size, size))
+        dag.sum_duplicates()
+        return labels, dag
+
+    # -------------------------------------------------------------------------
 
+    def _store_condensation(self, labels, dag, collection_name):
+        logging.info(
+            f"Graph {collection_name} has {dag.shape[0]} strongly connected components")
+        self.db.store_array(f"{collection_name}.{AotDbOps.SCC_LABELS}", labels)
+        self.db.store_array(f"{collection_name}.{AotDbOps.SCC_INDPTR}", dag.indptr)
+        self.db.store_array(f"{collection_name}.{AotDbOps.SCC_INDICES}", dag.indices)
+
+    # -------------------------------------------------------------------------
+
+    @staticmethod
+    def _get_ids_mask(ids, size):
+        mask = np.zeros(size, dtype=bool)
+        if len(ids) > 0:
+            mask[np.fromiter(ids, dtype=np.int64)] = True
+        return mask
+
+    # -------------------------------------------------------------------------
+
+    # create a recursive cache matrix out of graph edges;
+    # @cutoff_mask: if not None, nodes marked in the mask are removed from the graph
+    @staticmethod
+    def _create_recursive_cache(edges, size, cutoff_mask=None):
+        row_ind, col_ind = edges
+        if cutoff_mask is not None:
+            keep = ~cutoff_mask[row_ind] & ~cutoff_mask[col_ind]
+            row_ind = row_ind[keep]
+            col_ind = col_ind[keep]
+        # self cycles counted as 2
+        data = np.where(row_ind == col_ind, 2, 1).astype(np.int32)
+        return csr_matrix((data, (row_ind, col_ind)), shape=(size, size))
+
+    # -------------------------------------------------------------------------
+
+    @staticmethod
+    def _edges_matrix(edges, rows, cols):
+        row_ind, col_ind = edges
+        return AotDbOps._bool_matrix(csr_matrix(
+            (np.ones(row_ind.size, dtype=np.int32), (row_ind, col_ind)), shape=(rows, cols)))
+
+    # -------------------------------------------------------------------------
+
+    # set all the entries of a sparse matrix to 1 (the matrices are used as relations)
+    @staticmethod
+    def _bool_matrix(matrix):
+        matrix = matrix.tocsr()
+        matrix.sum_duplicates()
+        matrix.eliminate_zeros()
+        matrix.data = np.ones(matrix.data.size, dtype=np.int32)
         return matrix
 
     # -------------------------------------------------------------------------
 
+    # Functions depend on other functions not only through funrefs, but also implicitly
+    # through the types and globals they use (see CutOff._get_internal_candidates).
+    # Here we create a graph of funrefs extended with these implicit references:
+    # - the types of a function (refs, types and the types of its globals) and all
+    #   the types they reference (recursively) give functions and globals referenced
+    #   in those types
+    # - the globals of a function and those referenced by the types are extended with
+    #   the globals they reference and the functions referenced by all of them are added
+    # The graph uses the "refs" of types, which makes it a superset of what is discovered
+    # with --used-types-only; types defined inside other types are not excluded.
+    def _create_implicit_funrefs_cache(self, funcs_edges, types_edges, globs_edges,
+                                       funcs_size, types_size, globs_size):
+        logging.info("Creating implicit funrefs cache")
+        m = AotDbOps._edges_matrix
+        b = AotDbOps._bool_matrix
+        funcs_funcs = m(funcs_edges["funrefs"], funcs_size, funcs_size)
+        funcs_types = b(m(funcs_edges["refs"], funcs_size, types_size) +
+                        m(funcs_edges["types"], funcs_size, types_size))
+        funcs_globs = m(funcs_edges["globalrefs"], funcs_size, globs_size)
+        types_types = m(types_edges["refs"], types_size, types_size)
+        types_funcs = m(types_edges["funrefs"], types_size, funcs_size)
+        types_globs = m(types_edges["globalrefs"], types_size, globs_size)
+        globs_funcs = m(globs_edges["funrefs"], globs_size, funcs_size)
+        globs_globs = m(globs_edges["globalrefs"], globs_size, globs_size)
+        globs_types = m(globs_edges["type"], globs_size, types_size)
+
+        # the types of the referenced globals are used as well
+        funcs_types = b(funcs_types + funcs_globs @ globs_types)
+        types_types = b(types_types + types_globs @ globs_types)
+
+        # for each type: functions and globals referenced by the type or by any of
+        # the types it references (recursively); the relation grows with each step
+        # until it reaches the fixed point
+        carried = b(hstack([types_funcs, types_globs]))
+        closure = carried
+        while True:
+            next_closure = b(carried + types_types @ closure)
+            if next_closure.nnz == closure.nnz:
+                break
+            closure = next_closure
+
+        funcs_closure = b(funcs_types @ closure)
+        globs = b(funcs_globs + funcs_closure[:, funcs_size:])
+        globs = b(globs + globs @ globs_globs)
+        matrix = b(funcs_funcs + funcs_closure[:, :funcs_size] + globs @ globs_funcs)
+
+        logging.info(
+            f"Implicit funrefs graph has {matrix.nnz} edges ({funcs_funcs.nnz} funrefs)")
+        self.funcs_tree_implicit_funrefs = matrix
+        self._store_cache_matrix(matrix, AotDbOps.FUNCS_IMPLICIT_REFS)
+
+    # -------------------------------------------------------------------------
+
+    # store the source file id of each function (see get_funcs_sources)
+    def _create_funcs_sources(self, edges, size):
+        row_ind, col_ind = edges
+        sources = np.full(size, -1, dtype=np.int64)
+        sources[row_ind] = col_ind
+        self.funcs_sources = sources
+        self.db.store_array(AotDbOps.FUNCS_SOURCES, sources)
+
+    # -------------------------------------------------------------------------
+
+    # returns an array with the source file id of each function id
+    # (-1 for funcdecls and unresolved functions)
+    def get_funcs_sources(self):
+        if self.funcs_sources is None:
+            sources = self.db.load_array(AotDbOps.FUNCS_SOURCES)
+            if sources is None:
+                # db images created before the array was stored
+                logging.info("Function sources not found in the db - will collect them now")
+                size = len(self.db["funcs"]) + \
+                    len(self.db["funcdecls"]) + len(self.db["unresolvedfuncs"])
+                sources = np.full(size, -1, dtype=np.int64)
+                for f in self.db["funcs"]:
+                    sources[f["id"]] = f["fid"]
+            self.funcs_sources = sources
+        return self.funcs_sources
+
+    # -------------------------------------------------------------------------
+
+    def _store_cache_matrix(self, matrix, collection_name):
+        # store the matrix in CSR format as binary arrays next to the db image
+        self.db.store_array(f"{collection_name}.{AotDbOps.DATA}", matrix.data)
+        self.db.store_array(f"{collection_name}.{AotDbOps.INDICES}", matrix.indices)
+        self.db.store_array(f"{collection_name}.{AotDbOps.INDPTR}", matrix.indptr)
+
+    # -------------------------------------------------------------------------
+
+    # create, condense and store the recursive cache matrices;
+    # the matrices are created in --jobs worker processes
+    # @graphs: a list of (attribute name, collection name, edges, graph size,
+    #   cut-off mask, condense) tuples
+    def _create_recursive_caches(self, graphs):
+        global _import_graphs
+        _import_graphs = graphs
+        work = range(len(graphs))
+        if self.jobs > 1:
+            ctx = multiprocessing.get_context("fork")
+            with ctx.Pool(processes=min(self.jobs, len(graphs))) as pool:
+                results = list(pool.imap_unordered(_create_import_graph, work))
+        else:
+            results = [_create_import_graph(i) for i in work]
+        _import_graphs = None
+
+        for i, matrix, condensation in results:
+            attr_name, collection_name = graphs[i][0], graphs[i][1]
+            setattr(self, attr_name, matrix)
+            self._store_cache_matrix(matrix, collection_name)
+            if condensation is not None:
+                labels, dag = condensation
+                self._store_condensation(labels, dag, collection_name)
+
+    # -------------------------------------------------------------------------
+
+    # discover type duplicates, identical typedefs, implicit types and internal types
+    # and store them in the db; internal types are stored for both the "refs" and
+    # the "usedrefs" variant as the choice depends on the --used-types-only option
+    def _store_types_data(self):
+        logging.info("Discovering type duplicates and internal types")
+        self.deps.discover_type_duplicates()
+        internal_types = self.deps._get_internal_types(False)
+        used_internal_types = self.deps._get_internal_types(True)
+
+        self.db.store_many_in_collection(
+            AotDbOps.DUP_TYPES, [{"id": k, "dups": v} for k, v in self.deps.dup_types.items()])
+        self.db.store_array(AotDbOps.TYPE_CANONICAL, self.deps.type_canonical)
+        self.db.store_many_in_collection(
+            AotDbOps.IDENTICAL_TYPEDEFS, [{"id": k, "ids": list(v)} for k, v in self.deps.identical_typedefs.items()])
+        self.db.store_many_in_collection(
+            AotDbOps.IMPLICIT_TYPES, [{"id": k} for k in self.deps.implicit_types])
+
+        internal_types_for_db = []
+        for k in set(internal_types.keys()) | set(used_internal_types.keys()):
+            internal_types_for_db.append({"id": k,
+                                          "ids": list(internal_types.get(k, [])),
+                                          "used_ids": list(used_internal_types.get(k, []))})
+        self.db.store_many_in_collection(
+            AotDbOps.INTERNAL_TYPES, internal_types_for_db)
+        logging.info("Type data stored")
+
+    # -------------------------------------------------------------------------
+
+    # load the type data stored by _store_types_data to deps;
+    # returns False if the data is not present in the db
+    def _load_types_data(self):
+        if not self.db.collection_exists(AotDbOps.DUP_TYPES):
+            return False
+
+        logging.info("Loading type data")
+        self.deps.dup_types = {}
+        for item in self.db.create_local_index(AotDbOps.DUP_TYPES, "id").get_all():
+            self.deps.dup_types[item["id"]] = item["dups"]
+        canonical = self.db.load_array(AotDbOps.TYPE_CANONICAL)
+        if canonical is None:
+            # db images created before the array was stored
+            canonical = self.deps._create_type_canonical()
+        self.deps.set_type_canonical(canonical)
+
+        self.deps.identical_typedefs = {}
+        for item in self.db.create_local_index(AotDbOps.IDENTICAL_TYPEDEFS, "id").get_all():
+            self.deps.identical_typedefs[item["id"]] = set(item["ids"])
+
+        self.deps.implicit_types = set()
+        for item in self.db.create_local_index(AotDbOps.IMPLICIT_TYPES, "id").get_all():
+            self.deps.implicit_types.add(item["id"])
+
+        field = "used_ids" if self.deps.args.used_types_only else "ids"
+        self.deps.internal_types = {}
+        for item in self.db.create_local_index(AotDbOps.INTERNAL_TYPES, "id").get_all():
+            if len(item[field]) > 0:
+                self.deps.internal_types[item["id"]] = set(item[field])
+
+        logging.info(
+            f"Loaded {len(self.deps.dup_types)} type dups, {len(self.deps.implicit_types)} implicit types " +
+            f"and {len(self.deps.internal_types)} internal types")
+        return True
+
+    # -------------------------------------------------------------------------
+
+    # return the concatenated column indices of the given CSR rows
+    @staticmethod
+    def _csr_gather_rows(indptr, indices, rows):
+        starts = indptr[rows]
+        counts = indptr[rows + 1] - starts
+        total = counts.sum()
+        if total == 0:
+            return indices[:0]
+        # positions of all the rows' entries in the indices array
+        offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+        return indices[offsets + np.arange(total)]
+
+    # -------------------------------------------------------------------------
+
+    # multi-source reachability: expand the whole set of seed items level by level
+    # by gathering the neighbours of the current frontier from the CSR rows;
+    # returns a boolean mask over the graph nodes with all nodes reachable from
+    # any of the items (the items themselves included)
+    @staticmethod
+    def _graph_reachable_mask(csr_matrix, items):
+        size = csr_matrix.shape[0]
+        mask = np.zeros(size, dtype=bool)
+        frontier = np.unique(np.fromiter(items, dtype=np.int64))
+        if frontier.size == 0:
+            return mask
+        mask[frontier] = True
+        while frontier.size > 0:
+            neighbours = AotDbOps._csr_gather_rows(
+                csr_matrix.indptr, csr_matrix.indices, frontier)
+            neighbours = np.unique(neighbours[~mask[neighbours]])
+            mask[neighbours] = True
+            frontier = neighbours
+        return mask
+
+    # -------------------------------------------------------------------------
+
+    # reachability constrained to the nodes marked in @admit_mask: the graph is walked
+    # from the items through the admitted nodes only; the neighbours which are not
+    # admitted are not entered and form the external frontier of the walk;
+    # the nodes marked in @stop_mask (including the items) are not explored further;
+    # returns a tuple of arrays: (reached admitted ids, external frontier ids) -
+    # the items are among the admitted ids only if they are reached from other nodes
     @staticmethod
-    def _graph_dfs(csr_matrix, item):
-        nodes = depth_first_order(
-            csr_matrix, item, directed=True, return_predecessors=False)
-        nodes_int = [n.item() for n in nodes]
-        return nodes_int[1:]
+    def _graph_constrained_reachable(csr_matrix, items, admit_mask, stop_mask=None):
+        size = csr_matrix.shape[0]
+        internal = np.zeros(size, dtype=bool)
+        external = np.zeros(size, dtype=bool)
+        explored = np.zeros(size, dtype=bool)
+        frontier = np.unique(np.fromiter(items, dtype=np.int64))
+        if stop_mask is not None:
+            frontier = frontier[~stop_mask[frontier]]
+        explored[frontier] = True
+        while frontier.size > 0:
+            neighbours = np.unique(AotDbOps._csr_gather_rows(
+                csr_matrix.indptr, csr_matrix.indices, frontier))
+            admitted = admit_mask[neighbours]
+            external[neighbours[~admitted]] = True
+            neighbours = neighbours[admitted]
+            internal[neighbours] = True
+            neighbours = neighbours[~explored[neighbours]]
+            if stop_mask is not None:
+                neighbours = neighbours[~stop_mask[neighbours]]
+            explored[neighbours] = True
+            frontier = neighbours
+        return np.flatnonzero(internal), np.flatnonzero(external)
+
+    # -------------------------------------------------------------------------
+
+    # like _graph_reachable_mask but returns an array of the reachable ids
+    @staticmethod
+    def _graph_reachable(csr_matrix, items):
+        return np.flatnonzero(AotDbOps._graph_reachable_mask(csr_matrix, items))
+
+    # -------------------------------------------------------------------------
+
+    # multi-source reachability on a graph condensation (see get_cache_condensation):
+    # walks the DAG of the components of the items and returns an array with the ids
+    # of all the nodes in the reached components
+    @staticmethod
+    def _condensation_reachable(condensation, items):
+        labels, dag, members_ptr, members = condensation
+        items = np.fromiter(items, dtype=np.int64)
+        components = np.flatnonzero(
+            AotDbOps._graph_reachable_mask(dag, labels[items]))
+        return AotDbOps._csr_gather_rows(members_ptr, members, components)
 
     # -------------------------------------------------------------------------
 
@@ -599,6 +1092,30 @@ class AotDbOps:
 
     # -------------------------------------------------------------------------
 
+    # collect builtin func ids, funcs with asm and a map of static funcs
+    # for a func parsed from db.json
+    def _collect_func_data(self, f):
+        f_id = f["id"]
+        self._collect_builtin_func(f)
+        # get all functions with asm
+        if not self.include_asm:
+            if self._func_contains_assembly(f):
+                self.all_funcs_with_asm.add(f_id)
+        self.static_funcs_map[f_id] = []
+
+        if f["linkage"] == "internal":
+            for id in f["fids"]:
+                if id not in self.static_funcs_map[f_id]:
+                    self.static_funcs_map[f_id].append(id)
+
+    # -------------------------------------------------------------------------
+
+    def _collect_builtin_func(self, f):
+        if f["name"].startswith("__builtin"):
+            self.builtin_funcs_ids.add(f["id"])
+
+    # -------------------------------------------------------------------------
+
     def _func_contains_assembly(self, f):
         if "asm" not in f:
             return False
@@ -778,25 +1295,29 @@ class AotDbOps:
     def _get_recursive_by_id(self, collection, items, match_from_field, skip_list=None):
         all_items = set()
 
-        for i in items:
+        used_map = None
+        if self.globs_tree_globalrefs is not None and collection == "globals" and match_from_field == "globalrefs":
+            used_map = self.globs_tree_globalrefs
+        elif self.types_tree_refs is not None and collection == "types" and match_from_field == "refs":
+            used_map = self.types_tree_refs
+        elif self.types_tree_usedrefs is not None and collection == "types" and match_from_field == "usedrefs":
+            used_map = self.types_tree_usedrefs
+
+        if used_map is not None:
+            # a single traversal for all the items
+            all_items = set(self._graph_reachable(used_map, items).tolist())
+            if skip_list is not None:
+                all_items.difference_update(skip_list)
+            return all_items
 
-            if self.globs_tree_globalrefs is not None and collection == "globals" and match_from_field == "globalrefs":
-                # = self.dbops.globs_tree_globalrefs[i][match_from_field]
-                result_ids = self._graph_dfs(self.globs_tree_globalrefs, i)
-            elif self.types_tree_refs is not None and collection == "types" and match_from_field == "refs":
-                # = self.dbops.types_tree_refs[i][match_from_field]
-                result_ids = self._graph_dfs(self.types_tree_refs, i)
-            elif self.types_tree_usedrefs is not None and collection == "types" and match_from_field == "usedrefs":
-                # = self.dbops.types_tree_usedrefs[i][match_from_field]
-                result_ids = self._graph_dfs(self.types_tree_usedrefs, i)
-            else:
-                result_ids = self.db.make_recursive_query(
-                    collection,
-                    "id",
-                    i,
-                    match_from_field,
-                    "id",
-                    "id")
+        for i in items:
+            result_ids = self.db.make_recursive_query(
+                collection,
+                "id",
+                i,
+                match_from_field,
+                "id",
+                "id")
 
             if i not in result_ids:
                 result_ids.append(i)
@@ -862,3 +1383,19 @@ class AotDbOps:
         # now, let's get the true type of the global
         real_tid = self._get_real_type(type)
         return ret_tids, real_tid
+
+
+# ------------------------------------------------------------------------------
+
+# the graphs passed to the import workers (see AotDbOps._create_recursive_caches)
+_import_graphs = None
+
+
+def _create_import_graph(i):
+    _, collection_name, edges, size, cutoff_mask, condense = _import_graphs[i]
+    logging.info(f"Creating cache matrix {collection_name}, graph size is {size}")
+    matrix = AotDbOps._create_recursive_cache(edges, size, cutoff_mask)
+    condensation = None
+    if condense:
+        condensation = AotDbOps._condense_graph(matrix)
+    return i, matrix, condensation
@@ -61,7 +61,10 @@ class CodeGen:
         self.deps = deps
         self.cutoff = cutoff
         self.args = args
+        self.reset()
 
+    # clear the state gathered while generating a single off-target
+    def reset(self):
         self.generated_functions = 0
         self.generated_stubs = 0
         self.unrolled_simple_macro_counter = 0
@@ -12,6 +12,11 @@
 import logging
 import os
 import sys
+import json
+import fcntl
+import hashlib
+import tempfile
+import numpy as np
 
 class Module:
 
@@ -36,16 +41,44 @@ class CutOff:
     FUNC_STATS_BASIC = 'basic'
     FUNC_STATS_DETAILED = 'detailed'
 
+    # the size of the blocks of the db file used for the cut-off cache key
+    CACHE_BLOCK_SIZE = 1024 * 1024
+
     def __init__(self, dbops, args, basconnector, deps):
         self.dbops = dbops
         self.args = args
         self.basconnector = basconnector
         self.deps = deps
 
-        self.co_funcs = set(args.co_funcs)
-        self.co_dirs = set(args.co_dirs)
-        self.co_modules = set(args.co_modules)
-        self.co_files = set(args.co_files)
+        self.modules = {}  # map modules -> functions
+        self.fid_to_mods = {}  # map functions -> modules
+        self.fid_to_dirs = {}  # map functions -> source directories
+
+        # cache to limit the number of expensive recursive queries
+        self.stats_cache = {}
+        # map functions -> referenced functions (see _get_internal_candidates)
+        self.funrefs_cache = {}
+
+        # the maps above depend on the database only - they are stored in a
+        # sidecar file next to the db file and reused in the subsequent runs
+        self.cache_file = None
+        self.cache_key = None
+        self.cache_loaded = False
+        self.cache_dirty = False
+        if getattr(args, "db", None):
+            self.cache_file = f"{os.path.splitext(args.db)[0]}_cutoff.json"
+
+        self.reset()
+
+    # -------------------------------------------------------------------------
+
+    # Clear the per-target state; the module and directory mappings depend
+    # on the database only and are kept between targets
+    def reset(self):
+        self.co_funcs = set(self.args.co_funcs)
+        self.co_dirs = set(self.args.co_dirs)
+        self.co_modules = set(self.args.co_modules)
+        self.co_files = set(self.args.co_files)
 
         # the set of functions that we wish to emit the code for
         self.internal_funcs = set()
@@ -54,29 +87,140 @@ class CutOff:
         # of what is considered to be an off-target border
         self.external_funcs = set()
 
-        self.modules = {}  # map modules -> functions
-        self.fid_to_mods = {}  # map functions -> modules
-        self.fid_to_dirs = {}  # map functions -> source directories
+    # -------------------------------------------------------------------------
 
-        # cache to limit the number of expensive recursive queries
-        self.stats_cache = {}
+    # The cache is keyed by a checksum of the db file: its size, modification time
+    # and the data at its beginning and end (hashing the whole multi-GB image on
+    # every run would cost more than the cache saves); the stats cache also
+    # depends on the stats mode and on whether we include functions with asm;
+    # in the remote BAS mode the modules come from the BAS server rather than
+    # from the db, so the server URL (with the product build) is a part of the key
+    def _get_cache_key(self):
+        st = os.stat(self.args.db)
+        h = hashlib.sha256(f"{st.st_size}:{st.st_mtime_ns}".encode())
+        if self.basconnector is not None and self.basconnector.remote:
+            h.update(f":{self.basconnector.url}".encode())
+        block_size = CutOff.CACHE_BLOCK_SIZE
+        with open(self.args.db, "rb") as f:
+            h.update(f.read(block_size))
+            if st.st_size > block_size:
+                f.seek(max(block_size, st.st_size - block_size))
+                h.update(f.read(block_size))
+        return h.hexdigest()
+
+    def _get_stats_cache_name(self):
+        return f"{self.args.func_stats}_{self.args.include_asm}"
 
     # -------------------------------------------------------------------------
 
-    # given a function, find (recursively) all functions that is calls which are inside
-    # same module; this is done with the use of information from BAS
-    # @belongs: cut-off
+    # load the module/directory maps and the stats cache stored by previous runs;
+    # called lazily when the maps are first needed
+    def _load_cache(self):
+        if self.cache_loaded or self.cache_file is None:
+            return
+        self.cache_loaded = True
+        try:
+            self.cache_key = self._get_cache_key()
+            if not os.path.isfile(self.cache_file):
+                return
+            with open(self.cache_file, "r") as f:
+                cache = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Unable to load cut-off cache {self.cache_file}: {e}")
+            return
 
-    def _get_internal_funcs(self, f, internal_funcs, external_funcs):
+        if cache.get("key") != self.cache_key:
+            logging.info(f"Cut-off cache {self.cache_file} is out of date - will not use it")
+            return
+
+        for fid, mod_paths in cache["fid_to_mods"].items():
+            fid = int(fid)
+            if fid not in self.fid_to_mods:
+                self.fid_to_mods[fid] = mod_paths
+                for mod_path in mod_paths:
+                    if mod_path not in self.modules:
+                        self.modules[mod_path] = Module(mod_path)
+                    self.modules[mod_path].fids.add(fid)
+        for fid, dirs in cache["fid_to_dirs"].items():
+            self.fid_to_dirs.setdefault(int(fid), set(dirs))
+        for fid, fids in cache["stats_cache"].get(self._get_stats_cache_name(), {}).items():
+            self.stats_cache.setdefault(int(fid), set(fids))
+        logging.info(
+            f"Loaded cut-off cache with {len(self.fid_to_dirs)} functions from {self.cache_file}")
+
+    # -------------------------------------------------------------------------
+
+    # store the maps in the cache file if they were extended in this run;
+    # the maps stored meanwhile by the other processes (e.g. the --jobs workers)
+    # are merged with ours, so that no classified functions are lost
+    def _store_cache(self):
+        if self.cache_file is None or self.cache_key is None or not self.cache_dirty:
+            return
+        fid_to_mods = {str(fid): mod_paths for fid, mod_paths in self.fid_to_mods.items()}
+        fid_to_dirs = {str(fid): list(dirs) for fid, dirs in self.fid_to_dirs.items()}
+        stats_cache = {str(fid): list(fids) for fid, fids in self.stats_cache.items()}
+        stats_caches = {}
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache_file)), exist_ok=True)
+            # the read, merge and replace of the cache file is serialized between the processes
+            with open(f"{self.cache_file}.lock", "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    with open(self.cache_file, "r") as f:
+                        cache = json.load(f)
+                except (OSError, ValueError):
+                    cache = {}
+                if cache.get("key") == self.cache_key:
+                    for fid, mod_paths in cache.get("fid_to_mods", {}).items():
+                        fid_to_mods.setdefault(fid, mod_paths)
+                    for fid, dirs in cache.get("fid_to_dirs", {}).items():
+                        fid_to_dirs.setdefault(fid, dirs)
+                    # keep the stats caches of the other stats modes
+                    stats_caches = cache.get("stats_cache", {})
+                    for fid, fids in stats_caches.get(self._get_stats_cache_name(), {}).items():
+                        stats_cache.setdefault(fid, fids)
+                stats_caches[self._get_stats_cache_name()] = stats_cache
+
+                cache = {
+                    "key": self.cache_key,
+                    "fid_to_mods": fid_to_mods,
+                    "fid_to_dirs": fid_to_dirs,
+                    "stats_cache": stats_caches
+                }
+                # write to a temporary file first so that the readers
+                # never see a partially written cache
+                fd, tmpname = tempfile.mkstemp(
+                    dir=os.path.dirname(os.path.abspath(self.cache_file)))
+                with os.fdopen(fd, "w") as f:
+                    json.dump(cache, f)
+                os.replace(tmpname, self.cache_file)
+            self.cache_dirty = False
+            logging.info(
+                f"Stored cut-off cache with {len(fid_to_dirs)} functions in {self.cache_file}")
+        except OSError as e:
+            logging.warning(f"Unable to store cut-off cache {self.cache_file}: {e}")
+
+    # -------------------------------------------------------------------------
+
+    # get the functions referenced by the function f: its funrefs and the implicit
+    # dependencies coming from the types and globals it uses (and function pointers);
+    # returns None if the function should not be explored further
+    def _get_internal_candidates(self, f, external_funcs):
         base_fid = f["id"]
 
         if not self.args.include_asm and base_fid in self.dbops.all_funcs_with_asm:
             logging.info(
                 f"Skipping further exploration for a function with asm: {self.dbops._get_function_name(base_fid)}")
-            return
+            return None
         if base_fid in self.dbops.known_funcs_ids:
             logging.info("Skipping further exploration for a known function")
-            return
+            return None
+
+        # the referenced functions depend only on the function itself, unless the
+        # function was marked external (then the types used in its body are skipped)
+        cacheable = base_fid not in external_funcs
+        if cacheable and base_fid in self.funrefs_cache:
+            return self.funrefs_cache[base_fid]
 
         logging.debug("Processing function {}".format(base_fid))
         funrefs = set(f["funrefs"])
@@ -105,85 +249,116 @@ class CutOff:
                 for expr in fptrs:
                     funrefs.update([fid for fid in expr[1]])
 
-        for fid in funrefs:
-            logging.debug("checking funref {} ".format(fid))
-            ext = False  # deciding if the function is external or not
+        funrefs = frozenset(funrefs)
+        if cacheable:
+            self.funrefs_cache[base_fid] = funrefs
+        return funrefs
 
-            if fid in self.dbops.always_inc_funcs_ids:
-                logging.info(f"Including internal func {fid}")
-            else:
-                if self.args.cut_off == CutOff.CUT_OFF_MODULE:
+    # -------------------------------------------------------------------------
+
+    # check if the function fid referenced by the internal function base_fid
+    # is outside of the off-target border
+    def _is_external(self, fid, base_fid):
+        ext = False  # deciding if the function is external or not
+
+        if fid in self.dbops.always_inc_funcs_ids:
+            logging.info(f"Including internal func {fid}")
+        else:
+            if self.args.cut_off == CutOff.CUT_OFF_MODULE:
+                if fid not in self.fid_to_mods:
+                    ext = True
+                    # fid will not be in fid_to_mods if it's an unresolved function in db.json
+                else:
+                    # internal functions are the ones residing in the same module
+
+                    _to_add = []
                     if fid not in self.fid_to_mods:
+                        _to_add.append(fid)
+                    if base_fid not in self.fid_to_mods:
+                        _to_add.append(base_fid)
+                    
+                    if len(_to_add) > 0:
+                        self._get_mods_and_dirs_for_funcs(_to_add)
+
+                    mods = self.fid_to_mods[fid]
+
+                    base_mods = self.fid_to_mods[base_fid]
+                    # let's check if the modules are the same
+                    # in principle we need to make sure that every module the base is compiled in,
+                    # is alos on the function's list of modules
+                    if 0 != len(set(base_mods).difference(mods)):
                         ext = True
-                        # fid will not be in fid_to_mods if it's an unresolved function in db.json
-                    else:
-                        # internal functions are the ones residing in the same module
-
-                        _to_add = []
-                        if fid not in self.fid_to_mods:
-                            _to_add.append(fid)
-                        if base_fid not in self.fid_to_mods:
-                            _to_add.append(base_fid)
-                        
-                        if len(_to_add) > 0:
-                            for _fid in _to_add:
-                                self._get_mods_and_dirs_for_f(_fid)
-
-                        mods = self.fid_to_mods[fid]
-
-                        base_mods = self.fid_to_mods[base_fid]
-                        # let's check if the modules are the same
-                        # in principle we need to make sure that every module the base is compiled in,
-                        # is alos on the function's list of modules
-                        if 0 != len(set(base_mods).difference(mods)):
-                            ext = True
-                elif self.args.cut_off == CutOff.CUT_OFF_DIRS:
-                    if fid not in self.fid_to_dirs:
-                        ext = True
-                        # fid will not be in fid_to_dirs if it's an unresolved function (see dbops._get_function_file)
-                    else:
-                        # internal functions are the ones residing in the specified dirs
-                        dirs = self.fid_to_dirs[fid]
-                        # it is enough that one of the function's dirs is on the co_dirs list
-                        if len(dirs.difference(self.co_dirs)) == len(dirs):
-                            ext = True
-
-                elif self.args.cut_off == CutOff.CUT_OFF_FUNCTIONS:
-                    # internal functions are the ones with names on the list
-                    name = self.dbops._get_function_name(fid)
-                    if name not in self.co_funcs:
-                        ext = True
-
-                elif self.args.cut_off == CutOff.CUT_OFF_FILES:
-                    # internal functions are the ones that reside in the
-                    # specified source files
-                    src, loc, srcs = self.dbops._get_function_file(fid)
-                    if src not in self.co_files:
+            elif self.args.cut_off == CutOff.CUT_OFF_DIRS:
+                if fid not in self.fid_to_dirs:
+                    ext = True
+                    # fid will not be in fid_to_dirs if it's an unresolved function (see dbops._get_function_file)
+                else:
+                    # internal functions are the ones residing in the specified dirs
+                    dirs = self.fid_to_dirs[fid]
+                    # it is enough that one of the function's dirs is on the co_dirs list
+                    if len(dirs.difference(self.co_dirs)) == len(dirs):
                         ext = True
 
-                # if the function is external but we specify --co-dirs, --co-files
-                # or --co-funcs, we check if we could pull the function in
-                if ext and self.args.cut_off != CutOff.CUT_OFF_DIRS and len(self.co_dirs) > 0:
-                    if fid in self.fid_to_dirs:
-                        dirs = self.fid_to_dirs[fid]
-                        # it is enough that one of the function's dirs is on the co_dirs list
-                        if len(dirs.difference(self.co_dirs)) != len(dirs):
-                            ext = False
-
-                if ext and self.args.cut_off != CutOff.CUT_OFF_FUNCTIONS and len(self.co_funcs) > 0:
-                    # internal functions are the ones with names on the list
-                    name = self.dbops._get_function_name(fid)
-                    if name in self.co_funcs:
+            elif self.args.cut_off == CutOff.CUT_OFF_FUNCTIONS:
+                # internal functions are the ones with names on the list
+                name = self.dbops._get_function_name(fid)
+                if name not in self.co_funcs:
+                    ext = True
+
+            elif self.args.cut_off == CutOff.CUT_OFF_FILES:
+                # internal functions are the ones that reside in the
+                # specified source files
+                src, loc, srcs = self.dbops._get_function_file(fid)
+                if src not in self.co_files:
+                    ext = True
+
+            # if the function is external but we specify --co-dirs, --co-files
+            # or --co-funcs, we check if we could pull the function in
+            if ext and self.args.cut_off != CutOff.CUT_OFF_DIRS and len(self.co_dirs) > 0:
+                if fid in self.fid_to_dirs:
+                    dirs = self.fid_to_dirs[fid]
+                    # it is enough that one of the function's dirs is on the co_dirs list
+                    if len(dirs.difference(self.co_dirs)) != len(dirs):
                         ext = False
 
-                if ext and self.args.cut_off != CutOff.CUT_OFF_FILES and len(self.co_files) > 0:
-                    # internal functions are the ones that reside in the
-                    # specified source files
-                    src, loc, srcs = self.dbops._get_function_file(fid)
-                    if src in self.co_files:
-                        ext = False
+            if ext and self.args.cut_off != CutOff.CUT_OFF_FUNCTIONS and len(self.co_funcs) > 0:
+                # internal functions are the ones with names on the list
+                name = self.dbops._get_function_name(fid)
+                if name in self.co_funcs:
+                    ext = False
+
+            if ext and self.args.cut_off != CutOff.CUT_OFF_FILES and len(self.co_files) > 0:
+                # internal functions are the ones that reside in the
+                # specified source files
+                src, loc, srcs = self.dbops._get_function_file(fid)
+                if src in self.co_files:
+                    ext = False
+
+        return ext
+
+    # -------------------------------------------------------------------------
 
-            if ext:
+    # given a function, find all functions that is calls which are inside
+    # same module; this is done with the use of information from BAS
+    # the call graph is explored depth-first with an explicit stack of the functions
+    # being processed and their remaining references
+    # @belongs: cut-off
+
+    def _get_internal_funcs(self, f, internal_funcs, external_funcs):
+        funrefs = self._get_internal_candidates(f, external_funcs)
+        if funrefs is None:
+            return
+        stack = [(f["id"], iter(funrefs))]
+
+        while len(stack) > 0:
+            base_fid, funrefs = stack[-1]
+            fid = next(funrefs, None)
+            if fid is None:
+                stack.pop()
+                continue
+
+            logging.debug("checking funref {} ".format(fid))
+            if self._is_external(fid, base_fid):
                 # logging.debug(
                 #    "Function {} is outside of base module {}".format(fid, base_fid))
                 external_funcs.add(fid)
@@ -197,8 +372,82 @@ class CutOff:
                     continue
                 if fid not in internal_funcs:
                     internal_funcs.add(fid)
-                    self._get_internal_funcs(
-                        tmp_f, internal_funcs, external_funcs)
+                    tmp_funrefs = self._get_internal_candidates(
+                        tmp_f, external_funcs)
+                    if tmp_funrefs is not None:
+                        stack.append((fid, iter(tmp_funrefs)))
+
+    # -------------------------------------------------------------------------
+
+    # check if the internal functions can be found with a single walk over the implicit
+    # funrefs graph created during import (see --co-graph): the dirs, functions and files
+    # cut-off algorithms decide whether a function is internal based on the function
+    # alone; the module algorithm compares the modules of the function with the modules
+    # of the function referencing it, which is not a per-function decision
+    def _get_cut_off_graph(self):
+        if not self.args.co_graph:
+            return None
+        if self.args.cut_off not in [CutOff.CUT_OFF_DIRS, CutOff.CUT_OFF_FUNCTIONS,
+                                     CutOff.CUT_OFF_FILES]:
+            logging.info(f"--co-graph is not supported for the {self.args.cut_off} cut-off")
+            return None
+        if self.args.fptr_analysis:
+            logging.info("--co-graph is not supported with --fptr-analysis")
+            return None
+        graph = self.dbops.get_cache_matrix(self.dbops.FUNCS_IMPLICIT_REFS)
+        if graph is None:
+            logging.info("The implicit funrefs graph is not present in the db - --co-graph is ignored")
+        return graph
+
+    # -------------------------------------------------------------------------
+
+    # create a mask over the function ids with the functions admitted inside of the
+    # off-target border by the dirs, functions and files cut-off algorithms,
+    # i.e. with all of --co-dirs, --co-funcs and --co-files taken into account
+    def _get_admission_mask(self, size):
+        sources = self.dbops.get_funcs_sources()[:size]
+        # only funcs can be internal (funcdecls and unresolved functions have no body)
+        is_func = sources >= 0
+
+        admitted_srcs = []
+        for sid in np.unique(sources[is_func]).tolist():
+            src = self.dbops.srcidmap[sid]
+            if src in self.co_files or os.path.dirname(src) in self.co_dirs:
+                admitted_srcs.append(sid)
+        mask = np.isin(sources, admitted_srcs)
+
+        for name in self.co_funcs:
+            funcs = self.dbops.fnmap[name]
+            if funcs is None:
+                continue
+            # fnmap returns a single function if the name is unique
+            if not isinstance(funcs, list):
+                funcs = [funcs]
+            for f in funcs:
+                mask[f["id"]] = True
+        for fid in self.dbops.always_inc_funcs_ids:
+            if fid < size:
+                mask[fid] = True
+        return mask & is_func
+
+    # -------------------------------------------------------------------------
+
+    # the counterpart of _get_internal_funcs for the cut-off algorithms supported
+    # by _get_cut_off_graph: all of the base functions are explored at once
+    # @belongs: cut-off
+    def _get_internal_funcs_from_graph(self, graph, base_fids, internal_funcs, external_funcs):
+        size = graph.shape[0]
+        admit_mask = self._get_admission_mask(size)
+        # known functions and functions with asm are not explored further
+        stop_ids = set(self.dbops.known_funcs_ids)
+        if not self.args.include_asm:
+            stop_ids |= self.dbops.all_funcs_with_asm
+        stop_mask = self.dbops._get_ids_mask(stop_ids, size)
+
+        internal, external = self.dbops._graph_constrained_reachable(
+            graph, base_fids, admit_mask, stop_mask)
+        internal_funcs.update(internal.tolist())
+        external_funcs.update(external.tolist())
 
     # -------------------------------------------------------------------------
 
@@ -219,51 +468,60 @@ class CutOff:
 
     # -------------------------------------------------------------------------
 
-    def _get_mods_and_dirs_for_f(self, fid):
-        src, loc, srcs = self.dbops._get_function_file(fid)
-        mod_paths = None
+    # collect the modules and the source directories of the given functions;
+    # the modules of all the functions are retrieved with a single BAS lookup
+    def _get_mods_and_dirs_for_funcs(self, fids):
+        self._load_cache()
+        # the maps of the functions processed before (in this or a previous run)
+        # are already complete; fid_to_dirs has an entry for every processed function
+        fids = [fid for fid in fids if fid not in self.fid_to_dirs]
+        if len(fids) == 0:
+            return
 
-        # Cut-off based on modules
-        if (src is None) and (loc is None):
-            # that is for the unresolved functions
-            mod_paths = ["/tmp/no_such_mod"]
-            #sys.exit(1)
-        else:
-            # logging.debug(f"function {fid}")
-            mod_paths = self.basconnector.get_module_for_source_file(
-                src, loc)
-            
-        for mod_path in mod_paths:
-            if mod_path not in self.modules:
-                self.modules[mod_path] = Module(mod_path)
-            self.modules[mod_path].fids.add(fid)
-            if fid not in self.fid_to_mods:
-                self.fid_to_mods[fid] = []
-            if mod_path not in self.fid_to_mods[fid]:            
-                self.fid_to_mods[fid].append(mod_path)
-            # else:
-            #    logging.error("Ambiguous function to module mapping for fid {}".format(fid))
-            #    sys.exit(1)
-
-        # cut-off based on the list of function names
-        # we don't really need to collect anything in that case - we will filter out
-        # based on names
-
-        # cut-off based on the list of directories
-        dirs = set()
-        if src is not None:
-            dirs.add(os.path.dirname(src))
-        else:
-            dirs.add("/tmp/no_such_file")
-        if len(dirs) != 0:
+        files = [(fid, self.dbops._get_function_file(fid)) for fid in fids]
+        locations = [loc for _, (src, loc, srcs) in files
+                     if (src is not None) or (loc is not None)]
+        # the lookup raises if the BAS server fails - none of the functions are
+        # recorded then, so that the failure is not stored in the cache file
+        # as functions without modules
+        all_mod_paths = iter(self.basconnector.get_modules_for_locations(locations))
+        self.cache_dirty = True
+
+        for fid, (src, loc, srcs) in files:
+            # Cut-off based on modules
+            if (src is None) and (loc is None):
+                # that is for the unresolved functions
+                mod_paths = ["/tmp/no_such_mod"]
+            else:
+                mod_paths = next(all_mod_paths)
+
+            for mod_path in mod_paths:
+                if mod_path not in self.modules:
+                    self.modules[mod_path] = Module(mod_path)
+                self.modules[mod_path].fids.add(fid)
+                if fid not in self.fid_to_mods:
+                    self.fid_to_mods[fid] = []
+                if mod_path not in self.fid_to_mods[fid]:
+                    self.fid_to_mods[fid].append(mod_path)
+
+            # cut-off based on the list of function names
+            # we don't really need to collect anything in that case - we will filter out
+            # based on names
+
+            # cut-off based on the list of directories
+            dirs = set()
+            if src is not None:
+                dirs.add(os.path.dirname(src))
+            else:
+                dirs.add("/tmp/no_such_file")
             if fid not in self.fid_to_dirs:
                 self.fid_to_dirs[fid] = dirs
-    
 
     # @base_fids: the ids of the functions we would like to create an off-target for
     # @fids: the ids of all the other functions (that we discovered recursively)
     # @belongs: deps or cut-off
     def _get_function_stats(self, base_fids, fids):
+        self._load_cache()
         base_functions = self.dbops.fnidmap.get_many(list(base_fids))
 
         # by default we'll add the dirs in which the base functions reside
@@ -281,15 +539,18 @@ class CutOff:
             logging.info(f"co_dirs is {self.co_dirs}")
             # self.co_files.add(src)
 
-        for fid in fids:
-            self._get_mods_and_dirs_for_f(fid)
-
         self.internal_funcs = set()
         self.external_funcs = set()
         logging.info("Getting internal functions")
-        for f in base_functions:
-            self._get_internal_funcs(
-                f, self.internal_funcs, self.external_funcs)
+        graph = self._get_cut_off_graph()
+        if graph is not None:
+            self._get_internal_funcs_from_graph(
+                graph, base_fids, self.internal_funcs, self.external_funcs)
+        else:
+            self._get_mods_and_dirs_for_funcs(fids)
+            for f in base_functions:
+                self._get_internal_funcs(
+                    f, self.internal_funcs, self.external_funcs)
         external_count = len(fids) - len(self.internal_funcs)
         logging.info("There are {} internal functions {} first external functions and {} external functions".format(
             len(self.internal_funcs), len(self.external_funcs), external_count))
@@ -326,6 +587,7 @@ class CutOff:
                 else:
                     self._get_called_functions(query)
                     self.stats_cache[fid] = query
+                    self.cache_dirty = True
                 logging.info("- [external] {} @ {} pulls in another {} functions".format(
                     f["name"], f["location"], len(query) - 1))
             else:
@@ -341,6 +603,7 @@ class CutOff:
                         # any others
                         if "funrefs" not in tmp or len(tmp["funrefs"]) == 0:
                             self.stats_cache[fid] = set([fid])
+                            self.cache_dirty = True
                             subtree_count = 0
                         else:
                             funcs = set(tmp["funrefs"])
@@ -364,6 +627,7 @@ class CutOff:
 
                             if subtree_count == 0:
                                 self.stats_cache[fid] = set([fid])
+                                self.cache_dirty = True
                     else:
                         # for funcdecls we wouldn't know how many
                         # other functions they call and also we would never
@@ -375,3 +639,5 @@ class CutOff:
                 else:
                     logging.info("- [external] {} @ {} pulls in another {} functions".format(
                         f["name"], f["location"], subtree_count))
+
+        self._store_cache()
@@ -8,11 +8,13 @@
 import os
 import sys
 import json
+import shutil
 import logging
-import hashlib
+import numpy as np
 from aotdb_api import AotDbCollection
 from aotdb_api import AotDbCollectionQuery
 from aotdb_api import AotDbFrontend
+from jsonstream import JsonStream
 from collections import OrderedDict
 
 try:
@@ -31,6 +33,9 @@ class FtdbFrontend(AotDbFrontend):
         super().create(json_file, product, version,
                        build_type, drop_on_import, cache_size)
         self.db_file = db_file
+        # arrays stored during import (name -> numpy array)
+        self.arrays = {}
+        self.arrays_dir = None
 
     def sanity_check(self):
         if not super().sanity_check():
@@ -51,10 +56,23 @@ class FtdbFrontend(AotDbFrontend):
 
         return True
 
-    def import_db_json(self, json_file):
+    def import_db_json(self, json_file, item_handlers=None):
+        handlers = {}
+        if item_handlers is not None:
+            handlers = {name: list(h) for name, h in item_handlers.items()}
+        # 'sources' and 'modules' are lists of {name: id} maps - we sort them out
+        # to 'source_info' and 'module_info' collections as they are parsed
+        self.json_data = {"source_info": [], "module_info": []}
+        handlers.setdefault("sources", []).append(
+            _info_collector(self.json_data["source_info"]))
+        handlers.setdefault("modules", []).append(
+            _info_collector(self.json_data["module_info"]))
+
         with open(json_file, "r") as f:
             logging.info("Loading JSON data from file")
-            self.json_data = json.load(f)
+            # the file is parsed incrementally - only the parsed data is kept in
+            # memory and not the whole JSON text
+            JsonStream(f).load_object(self.json_data, handlers)
             logging.info("Data loaded!")
             # during the import phase we want to use the json data as the db
             # after the import, ftdb will be used
@@ -66,80 +84,89 @@ class FtdbFrontend(AotDbFrontend):
 
         return self.json_data
 
-    def create_local_index(self, collection_name, field_name, extra_field_name=None, cache_size=0, unique=True):
+    def create_local_index(self, collection_name, field_name, extra_field_name=None, cache_size=0, unique=True,
+                           direct_index=False):
         name = collection_name
         if collection_name == "sources":
             name = "source_info"
         elif collection_name == "modules":
             name = "module_info"
         return FtdbCollectionQuery(self.collections[name], field_name, extra_field_name,
-                                   cache_size=cache_size, field_is_unique=unique)
-
-    def _query(self, visited, collection_name, base, match_from_field, match_to_field, value_to_return=None, cutoff_list=None):
-        collection = self.db[collection_name]
-        returned = []
-
-        if base[match_to_field] in visited:
-            return returned
-
-        visited.add(base[match_to_field])
-        results = None
-        from_obj = base[match_from_field]
+                                   cache_size=cache_size, field_is_unique=unique,
+                                   direct_index=direct_index)
 
+    # Generate the objects matched by the obj's match_from_field values.
+    # Values already visited are not looked up.
+    def _query_matches(self, collection_name, obj, match_from_field, match_to_field, visited, add_vals=None):
+        from_obj = obj[match_from_field]
         if isinstance(from_obj, list):
+            if add_vals:
+                from_obj = from_obj + list(add_vals)
             for item in from_obj:
                 if item in visited:
                     continue
+                for r in self.collections[collection_name].find(match_to_field, item):
+                    yield r
+        elif isinstance(from_obj, str):
+            for r in self.collections[collection_name].find(match_to_field, from_obj):
+                yield r
+        else:
+            logging.error("Unsupported field type!")
 
-                results = self.collections[collection_name].find(
-                    match_to_field, item)
-                for r in results:
-                    if r[match_to_field] in visited:
-                        continue
-                    if cutoff_list is not None and r[match_to_field] in cutoff_list:
-                        visited.add(r[match_to_field])
-
-                        continue
+    # The traversal uses an explicit stack rather than recursion, so deep chains
+    # won't hit the recursion limit. Objects are returned in post-order (an object
+    # goes after all the objects reachable from it), the base object is not returned.
+    def _query(self, visited, collection_name, base, match_from_field, match_to_field, value_to_return=None, cutoff_list=None,
+               add_vals=None):
+        returned = []
 
-                    returned += self._query(visited, collection_name, r,
-                                            match_from_field, match_to_field, value_to_return, cutoff_list)
-                    if value_to_return is not None:
-                        returned.append(r[value_to_return])
-                    else:
-                        returned.append(r)
-        elif isinstance(from_obj, str):
+        if base[match_to_field] in visited:
+            return returned
 
-            results = self.collections[collection_name].find(
-                match_to_field, from_obj)
-            for r in results:
+        if not isinstance(base[match_from_field], (list, str)):
+            logging.error("Unsupported field type!")
+            return None
 
+        visited.add(base[match_to_field])
+        stack = [(None, self._query_matches(collection_name, base, match_from_field,
+                                            match_to_field, visited, add_vals))]
+        while stack:
+            obj, matches = stack[-1]
+            for r in matches:
                 if r[match_to_field] in visited:
                     continue
+                visited.add(r[match_to_field])
                 if cutoff_list is not None and r[match_to_field] in cutoff_list:
-                    visited.add(r[match_to_field])
                     continue
-
-                returned += self._query(visited, collection_name, r,
-                                        match_from_field, match_to_field, value_to_return, cutoff_list)
-
-                if value_to_return is not None:
-                    returned.append(r[value_to_return])
-                else:
-                    returned.append(r)
-        else:
-            logging.error("Unsupported field type!")
-            return None
+                # descend: the rest of the current matches is processed once we're back
+                stack.append((r, self._query_matches(collection_name, r, match_from_field,
+                                                     match_to_field, visited)))
+                break
+            else:
+                stack.pop()
+                if obj is not None:
+                    if value_to_return is not None:
+                        returned.append(obj[value_to_return])
+                    else:
+                        returned.append(obj)
 
         return returned
 
     def make_recursive_query(self, collection_name, obj_selector_field, obj_selector_value, match_from_field, match_to_field, value_to_return=None, add_vals=None, cutoff_list=None):
-        hash_str = f"{collection_name}{obj_selector_field}{obj_selector_value}" +\
-                   f"{match_from_field}{match_to_field}{value_to_return}{add_vals}{cutoff_list}"
-        hash_str = hashlib.md5(hash_str.encode()).hexdigest()
-
-        if hash_str in self.query_cache:
+        # the sets are turned into frozensets for the cache key; frozenset caches its hash
+        # and frozenset(x) returns x for a frozenset, so callers passing the same frozenset
+        # of cut-off ids do not pay for hashing it again
+        key = (collection_name, obj_selector_field, obj_selector_value, match_from_field, match_to_field,
+               value_to_return,
+               frozenset(add_vals) if add_vals else None,
+               frozenset(cutoff_list) if cutoff_list is not None else None)
+
+        if key in self.query_cache:
             logging.debug("This exact query happened before")
-            return self.query_cache[hash_str]
+            self.query_cache_hits += 1
+            self.query_cache.move_to_end(key)
+            return self.query_cache[key]
+        self.query_cache_misses += 1
 
         visited = set()
         # get the object from which the search starts
@@ -152,21 +179,19 @@ class FtdbFrontend(AotDbFrontend):
             ret = []
             return ret
         if add_vals:
-            # the user specified additional values to query for
+            # the user specified additional values to query for;
+            # they are injected into the traversal without modifying the base object
             tmp = base[match_from_field]
             if not isinstance(tmp, list):
                 logging.error(
                     "Additional values specified but the destination field is not a list")
-            else:
-                base[match_from_field] += list(add_vals)
-                logging.debug("now {} field is {}".format(
-                    match_from_field, base[match_from_field]))
+                add_vals = None
 
         ret = self._query(visited, collection_name, base,
-                          match_from_field, match_to_field, value_to_return, cutoff_list)
+                          match_from_field, match_to_field, value_to_return, cutoff_list, add_vals)
 
         if self.query_cache_size > 0:
-            self.query_cache[hash_str] = ret
+            self.query_cache[key] = ret
             if len(self.query_cache) > self.query_cache_size:
                 self.query_cache.popitem(last=False)
                 logging.debug("QUERY CACHE FULL")
@@ -196,10 +221,13 @@ class FtdbFrontend(AotDbFrontend):
                                  "funcs_tree_funrefs_no_known", "funcs_tree_funrefs_no_known_no_asm",
                                  "globals", "globs_tree_globalrefs", "init_data", "known_data", "modules",
                                  "sources", "static_funcs_map", "types", "types_tree_refs", "types_tree_usedrefs",
-                                 "unresolvedfuncs", "source_info", "module_info"]
+                                 "unresolvedfuncs", "source_info", "module_info",
+                                 "dup_types", "identical_typedefs", "implicit_types", "internal_types",
+                                 "BAS_modules", "func_fptrs"]
         if self.db_file:
             logging.info(f"Loading data from {self.db_file} file")
             self.db.load(self.db_file, mp_safe=True)
+            self.arrays_dir = FtdbFrontend.get_arrays_dir(self.db_file)
             # with open(self.db_file, "r") as f:
             #     logging.info("Loading JSON data from file")
             #     self.json_data = json.load(f)
@@ -218,24 +246,19 @@ class FtdbFrontend(AotDbFrontend):
             # it means that we are in the import stage
             # so we have to store the db (which is an in-memory JSON dict) to a ftdb file
 
-            # sort out 'sources' and 'modules'
-            new_sources = []
-            for item in self.db['sources']:
-                for k in item:
-                    new_sources.append({'id': item[k], 'name': k})
-            self.db['source_info'] = new_sources
-            new_modules = []
-            for item in self.db['modules']:
-                for k in item:
-                    new_modules.append({'id': item[k], 'name': k})
-            self.db['module_info'] = new_modules
+            # 'source_info' and 'module_info' were sorted out from 'sources' and
+            # 'modules' during the import
 
             filename = self.json_file.replace(".json", ".img")
             logging.info(f"Storing database to {filename} file")
             libftdb.create_ftdb(self.db, filename, True)
+            self._save_arrays(FtdbFrontend.get_arrays_dir(filename))
             # with open(filename, "w") as f:
             #    json.dump(self.db, f, indent=4)
 
+    def collection_exists(self, name):
+        return name in self.db
+
     def store_in_collection(self, name, data):
         if name not in self.db:
             self.db[name] = []
@@ -247,6 +270,41 @@ class FtdbFrontend(AotDbFrontend):
         for d in data:
             self.db[name].append(d)
 
+    # the arrays are stored as .npy files in a directory next to the db image,
+    # e.g. db_arrays/ for db.img
+    @staticmethod
+    def get_arrays_dir(db_file):
+        return f"{os.path.splitext(db_file)[0]}_arrays"
+
+    def _save_arrays(self, arrays_dir):
+        logging.info(f"Storing {len(self.arrays)} arrays to {arrays_dir} directory")
+        # the arrays are written to a fresh directory which then replaces the old one;
+        # this way no arrays left over from the previous import are loaded with the new db
+        tmp_dir = f"{arrays_dir}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for name, array in self.arrays.items():
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), array)
+        shutil.rmtree(arrays_dir, ignore_errors=True)
+        os.replace(tmp_dir, arrays_dir)
+
+    def store_array(self, name, array):
+        self.arrays[name] = array
+
+    def load_array(self, name):
+        if name in self.arrays:
+            return self.arrays[name]
+        if self.arrays_dir is None:
+            return None
+        path = os.path.join(self.arrays_dir, f"{name}.npy")
+        if not os.path.isfile(path):
+            return None
+        # the arrays are memory-mapped so that they are loaded on demand
+        # and shared between the processes
+        array = np.load(path, mmap_mode="r")
+        self.arrays[name] = array
+        return array
+
     # makes it possible to add backend-specific arguments for the parser
     def parse_args(self, parser):
         super().parse_args(parser)
@@ -275,9 +333,17 @@ class FtdbFrontend(AotDbFrontend):
         self.disconnect()
 
 
+def _info_collector(info):
+    def collect(item):
+        for k in item:
+            info.append({'id': item[k], 'name': k})
+    return collect
+
+
 class FtdbCollectionQuery(AotDbCollectionQuery):
 
-    def __init__(self, collection, field, extra_field=None, cache_size=0, field_is_unique=True):
+    def __init__(self, collection, field, extra_field=None, cache_size=0, field_is_unique=True,
+                 direct_index=False):
         self.collection = collection
         self.field = field
         self.extra_field = extra_field
@@ -285,8 +351,42 @@ class FtdbCollectionQuery(AotDbCollectionQuery):
         self.field_is_unique = field_is_unique
         self.cache = OrderedDict()
         self.contains_cache = OrderedDict()
+        # in the direct index mode the records are kept in a table indexed by the field
+        # value; this is only possible for unique, dense integer fields such as ids
+        self.table = None
+        if direct_index and field_is_unique:
+            self._create_direct_index()
+
+    def _create_direct_index(self):
+        table = []
+        for item in self.collection:
+            key = item[self.field]
+            if not isinstance(key, int) or key < 0:
+                logging.warning(
+                    f"Cannot create direct index for field {self.field} of {self.collection.name}")
+                return
+            if key >= len(table):
+                table.extend([None] * (key + 1 - len(table)))
+            table[key] = item
+        self.table = table
+        logging.info(
+            f"Created direct index for field {self.field} of {self.collection.name} with {len(table)} entries")
+
+    def _get_direct(self, key):
+        try:
+            if 0 <= key < len(self.table):
+                return self.table[key]
+        except TypeError:
+            pass
+        return None
 
     def __getitem__(self, key):
+        if self.table is not None:
+            item = self._get_direct(key)
+            if item is not None and self.extra_field is not None:
+                item = item[self.extra_field]
+            return item
+
         item = None
         cache_hit = False
         if self.cache_size > 0:
@@ -316,8 +416,8 @@ class FtdbCollectionQuery(AotDbCollectionQuery):
             if self.field_is_unique:
                 item = item[self.extra_field]
             else:
-                for i in range(len(item)):
-                    item[i] = item[i][self.extra_field]
+                # don't modify the list in place - it might be stored in the cache
+                item = [element[self.extra_field] for element in item]
 
         if None != item and not self.field_is_unique and len(item) == 1:
             # no need to create 1-element lists
@@ -325,6 +425,9 @@ class FtdbCollectionQuery(AotDbCollectionQuery):
         return item
 
     def __contains__(self, key):
+        if self.table is not None:
+            return self._get_direct(key) is not None
+
         if self.cache_size > 0:
             if key in self.contains_cache:
                 return self.contains_cache[key]
@@ -342,29 +445,61 @@ class FtdbCollectionQuery(AotDbCollectionQuery):
 
         return ret
 
-    def get_many(self, list):
-        # we only support unique lists
-        if len(list) != len(set(list)):
-            return None
+    # Get items for all the keys in one go. The keys can be any iterable (duplicates
+    # are allowed) and the results are returned in the order of the keys; keys that
+    # are not found are skipped. For non-unique fields all the matching items
+    # are returned for each key.
+    def get_many(self, keys):
+        keys = list(keys)
 
-        if self.cache_size > 0:
-            # if we use cache, try multiple getitem calls (chances are the items are already in the cache)
+        if self.table is not None:
             result = []
-            for item in list:
-                data = self.__getitem__(item)
-                if data is not None:
-                    if self.field_is_unique:
-                        result.append(data)
-                    else:
-                        result = result + data
-
+            for key in keys:
+                item = self._get_direct(key)
+                if item is not None:
+                    if self.extra_field is not None:
+                        item = item[self.extra_field]
+                    result.append(item)
             return result
 
+        # first try the cache, then fetch all the missing items with a single
+        # pass over the collection
+        items = {}
+        missing = set()
+        for key in keys:
+            if key in items or key in missing:
+                continue
+            if self.cache_size > 0 and key in self.cache:
+                items[key] = self.cache[key]
+            else:
+                missing.add(key)
+
+        if len(missing) > 0:
+            found = self.collection.find_many(self.field, missing)
+            for key in missing:
+                item = found.get(key)
+                if item is not None and self.field_is_unique:
+                    item = item[0]
+                items[key] = item
+
+                if self.cache_size > 0:
+                    self.cache[key] = item
+                    if len(self.cache) > self.cache_size:
+                        self.cache.popitem(last=False)
+                        logging.debug("CACHE FULL")
+
         result = []
-        for item in list:
-            r = self.collection.find_one(self.field, item)
-            if r is not None:
-                result.append(r)
+        for key in keys:
+            item = items[key]
+            if item is None:
+                continue
+            if self.field_is_unique:
+                item = [item]
+            for element in item:
+                if self.extra_field is not None:
+                    element = element[self.extra_field]
+                result.append(element)
+
         return result
 
     def get_all(self):
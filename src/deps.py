@@ -16,6 +16,52 @@ import struct
 import re
 import sys
 import shutil
+import hashlib
+import numpy as np
+
+
+# Union-find over clashing ids: ids which clash with each other, directly or
+# through other ids, form a single group and share a clash number
+class ClashGroups:
+
+    def __init__(self):
+        self.parent = {}
+        self.nums = {}  # clash numbers by group root
+        self.counter = 0
+
+    def _find(self, id):
+        parent = self.parent
+        if id not in parent:
+            parent[id] = id
+            return id
+        while parent[id] != id:
+            parent[id] = parent[parent[id]]
+            id = parent[id]
+        return id
+
+    def _number(self, root):
+        if root not in self.nums:
+            self.nums[root] = self.counter
+            self.counter += 1
+
+    def add(self, id):
+        self._number(self._find(id))
+
+    def union(self, id1, id2):
+        root1 = self._find(id1)
+        root2 = self._find(id2)
+        if root1 != root2:
+            self.parent[root2] = root1
+            num1 = self.nums.pop(root1, None)
+            num2 = self.nums.pop(root2, None)
+            nums = [n for n in [num1, num2] if n is not None]
+            if len(nums) > 0:
+                self.nums[root1] = min(nums)
+        self._number(root1)
+
+    # returns a dictionary: id -> clash number
+    def get_nums(self):
+        return {id: self.nums[self._find(id)] for id in self.parent}
 
 
 class Deps:
@@ -45,10 +91,22 @@ class Deps:
         self.identical_typedefs = {}
         self.implicit_types = set()
         self.dup_types = {}
+        # type id -> the id of the representative of its duplicates (see set_type_canonical)
+        self.type_canonical = None
+        self.type_is_dup = None
         self.internal_types = {}
         self.global_types = set()
         self.deps_cache = {}
+        # the toposort level of each type over its cached deps
+        # (see _get_types_recursive)
+        self.type_level = {}
         self.args = args
+        self.reset()
+
+    # Clear the state gathered while generating a single off-target.
+    # The data derived from the database (type duplicates, internal types, deps cache)
+    # is kept, so that it can be reused for the next target in the batch mode.
+    def reset(self):
         # known functions are those that will be provided by the target system/env
         # e.g. printf
         self.known_funcs_present = set()
@@ -62,6 +120,9 @@ class Deps:
         self.glob_clash_counter = 0
         self.func_clash_nums = {}
         self.func_clash_counter = 0
+        self.type_clash_groups = ClashGroups()
+        self.glob_clash_groups = ClashGroups()
+        self.func_clash_groups = ClashGroups()
         self.function_clashes = {}
 
         self.literals = {}
@@ -89,33 +150,68 @@ class Deps:
     #  function_id: a function where the function invocation through a pointer takes place
     #  expr: the expression of the function invocation through a pointer
     #  called_fun_id: function id that could be possible stored (and invoked) through the pointer at the given expression
+    # The funcs are scanned once; the types are looked up through dbops.typemap and
+    # the struct members called through a pointer are resolved once per member.
     def _infer_functions(self, json_data: dict) -> dict:
+        typemap = self.dbops.typemap
 
-        # save all funcs
         funcsaddresstaken = set()
         funcsbytype = {}
-        funcTypeCandidates = {}
+        # first level struct assignment
+        fucnsFirstLevelStruct = set()
+        funDict = {}
+        # icalls through struct members: (member key, deref, func id) and
+        # through function pointer variables: (deref, func, type id)
+        iCallsStructRefs = []
+        iCallsVarRefs = []
 
         for fun in json_data["funcs"]:
-            for deref in fun["derefs"]:
-                if deref["kind"] != "assign" and deref["kind"] != "init":
-                    continue
-                functions = list(
-                    filter(lambda x: x["kind"] == "function", deref["offsetrefs"]))
-                if not functions:
-                    continue
-                for function in functions:
-                    funcsaddresstaken.add(function["id"])
+            funDict[fun["id"]] = fun
+            derefs = fun["derefs"]
+            for deref in derefs:
+                kind = deref["kind"]
+                if kind == "assign" or kind == "init":
+                    functions = [x for x in deref["offsetrefs"]
+                                 if x["kind"] == "function"]
+                    if not functions:
+                        continue
+                    for function in functions:
+                        funcsaddresstaken.add(function["id"])
+                    if deref["offsetrefs"][0]["kind"] != "member":
+                        continue
+                    structDerefId = deref["offsetrefs"][0]["id"]
+                    structTypeId = derefs[structDerefId]["type"][-1]
+                    structMemberId = derefs[structDerefId]["member"][-1]
+                    for function in functions:
+                        fucnsFirstLevelStruct.add(
+                            (structTypeId, structMemberId, function["id"]))
+                elif kind == "member":
+                    if not "mcall" in deref:
+                        continue
+                    for i, membcall in enumerate(deref["mcall"]):
+                        if membcall == -1:
+                            continue
+                        iCallsStructRefs.append(
+                            ((deref["type"][i], deref["member"][i]), deref, fun))
+                elif kind == "function":
+                    offsetref = deref["offsetrefs"][0]
+                    if offsetref["kind"] == "local":
+                        iCallsVarRefs.append(
+                            (deref, fun, fun["locals"][offsetref["id"]]["type"]))
+                    elif offsetref["kind"] == "param":
+                        iCallsVarRefs.append(
+                            (deref, fun, fun["params"][offsetref["id"]]["type"]))
+                    elif offsetref["kind"] == "global":
+                        # the type of the global is known once the globals are scanned
+                        iCallsVarRefs.append((deref, fun, None))
 
         # from global variables take all funrefs as funcs with address taken
+        globalTypes = {}
         for var in json_data["globals"]:
+            globalTypes[var["id"]] = var["type"]
             for funid in var["funrefs"]:
                 funcsaddresstaken.add(funid)
 
-        funDict = {}
-        for fun in json_data["funcs"]:
-            funDict[fun["id"]] = fun
-
         for function in funcsaddresstaken:
             if function not in funDict:  # handle if it is in funcdecls or unresolved
                 continue
@@ -126,42 +222,6 @@ class Deps:
             else:
                 funcsbytype[typeTuple].append(f)
 
-        for typ in json_data["types"]:
-            if typ["class"] == "function":
-                typeTuple = tuple(typ["refs"])
-                if typeTuple in funcsbytype:
-                    funcTypeCandidates[typ["id"]] = funcsbytype[typeTuple]
-                else:
-                    funcTypeCandidates[typ["id"]] = []
-
-        globalDict = {}
-        for glob in json_data["globals"]:
-            globalDict[glob["id"]] = glob
-
-        typeDict = {}
-        for fun in json_data["types"]:
-            typeDict[fun["id"]] = fun
-
-        # first level struct assignment
-        fucnsFirstLevelStruct = set()
-        for fun in json_data["funcs"]:
-            for deref in fun["derefs"]:
-                if deref["kind"] != "assign" and deref["kind"] != "init":
-                    continue
-                functions = list(
-                    filter(lambda x: x["kind"] == "function", deref["offsetrefs"]))
-                if not functions:
-                    continue
-                if deref["offsetrefs"][0]["kind"] != "member":
-                    continue
-                structDerefId = deref["offsetrefs"][0]["id"]
-                structTypeId = fun["derefs"][structDerefId]["type"][-1]
-                structMemberId = fun["derefs"][structDerefId]["member"][-1]
-
-                for function in functions:
-                    fucnsFirstLevelStruct.add(
-                        (structTypeId, structMemberId, function["id"]))
-
         fopbased = set()
 
         if "vars" in json_data["fops"]: # legacy format
@@ -172,7 +232,7 @@ class Deps:
                     continue
                 recordsByName.setdefault(type["str"], [])
                 recordsByName[type["str"]].append(type)
-            
+
             for fop in json_data["fops"]["vars"]:
                 for record in recordsByName[fop["type"]]:
                     for member in fop["members"]:
@@ -182,11 +242,7 @@ class Deps:
                             (record["id"], member, fop["members"][member]))
         else:
             for fop in json_data["fops"]:
-                record = None
-                for t in json_data["types"]:
-                    if t["id"] == fop["id"]:
-                        record = t
-                        break
+                record = typemap[fop["id"]]
                 if record is not None:
                     for member in fop["members"]:
                         for f_id in fop["members"][member]:
@@ -205,43 +261,17 @@ class Deps:
             funcsbytypeFirstLevel.setdefault((structId, memberId), [])
             funcsbytypeFirstLevel[(structId, memberId)].append((f))
 
-        firstError = True
-
-        # and than we need to get icalls with struct type
+        # and than we need to get icalls with struct type;
+        # member key -> (first level id, function type refs) or None if unsupported
+        resolvedMembers = {}
         iCallsStruct = []
-        for func in json_data["funcs"]:
-            for deref in func["derefs"]:
-                if deref["kind"] != "member":
-                    continue
-                if not "mcall" in deref:
-                    continue
-                for i, membcall in enumerate(deref["mcall"]):
-                    if membcall == -1:
-                        continue
-                    structType = typeDict[deref["type"][i]]
-                    while structType["class"] == "pointer" or structType["class"] == "typedef":
-                        structType = typeDict[structType["refs"][0]]
-
-                    if deref["member"][i] >= len(structType["refs"]):
-                        continue
-
-                    functype = typeDict[structType["refs"][deref["member"][i]]]
-                    memberId = deref["member"][i]
-                    while functype["class"] == "pointer" or functype["class"] == "typedef" or functype["class"] == "const_array":
-                        functype = typeDict[functype["refs"][0]]
-                    if functype["class"] == "function":
-                        iCallsStruct.append(
-                            ((structType["id"], memberId), deref, func, tuple(functype["refs"])))
-                    elif functype["str"] == "void":
-                        iCallsStruct.append(
-                            ((structType["id"], memberId), deref, func, None))
-                    else:
-                        logging.error(f"Unsupported case found!")
-                        logging.error(f">>> functype: {functype}")
-                        logging.error(f">>> func: {func['name']}")
-                        logging.error(f">>> deref: {deref}")
-                        logging.error("Tracing function pointer calls")
-                        continue
+        for memberKey, deref, func in iCallsStructRefs:
+            if memberKey not in resolvedMembers:
+                resolvedMembers[memberKey] = self._resolve_member_call(
+                    memberKey, deref, func)
+            resolved = resolvedMembers[memberKey]
+            if resolved is not None:
+                iCallsStruct.append((resolved[0], deref, func, resolved[1]))
 
         output = {}
         for firstLevelId, deref, func, functypetuple in iCallsStruct:
@@ -255,36 +285,21 @@ class Deps:
             output.setdefault(func["id"], {})
             output[func["id"]][deref["expr"]] = funcCandidates
 
-        funccals = []
-        for fun in json_data["funcs"]:
-            for deref in fun["derefs"]:
-                if deref["kind"] == "function":
-                    funccals.append((deref, fun))
-        iCallsVar = []
-        for deref, fun in funccals:
-            if deref["offsetrefs"][0]["kind"] == "unary":
-                # deref = fun["derefs"][deref["offsetrefs"][0]["id"]]
-                continue
-
-            if deref["offsetrefs"][0]["kind"] == "global":
-                typeId = globalDict[deref["offsetrefs"][0]["id"]]["type"]
-            elif deref["offsetrefs"][0]["kind"] == "local":
-                typeId = fun["locals"][deref["offsetrefs"][0]["id"]]["type"]
-            elif deref["offsetrefs"][0]["kind"] == "param":
-                typeId = fun["params"][deref["offsetrefs"][0]["id"]]["type"]
-            elif deref["offsetrefs"][0]["kind"] == "array":
-                continue
-            else:
-                continue
-            functype = typeDict[typeId]
-            while functype["class"] == "pointer" or functype["class"] == "typedef" or functype["class"] == "const_array":
-                functype = typeDict[functype["refs"][0]]
-            if functype["str"] == "void":
-                continue
-            iCallsVar.append((deref, fun, tuple(functype["refs"])))
-
-        for deref, func, functypetuple in iCallsVar:
-            if functypetuple in funcsbytype:
+        # function types of the pointer variables by type id
+        resolvedTypes = {}
+        for deref, func, typeId in iCallsVarRefs:
+            if typeId is None:
+                typeId = globalTypes[deref["offsetrefs"][0]["id"]]
+            if typeId not in resolvedTypes:
+                functype = typemap[typeId]
+                while functype["class"] == "pointer" or functype["class"] == "typedef" or functype["class"] == "const_array":
+                    functype = typemap[functype["refs"][0]]
+                if functype["str"] == "void":
+                    resolvedTypes[typeId] = None
+                else:
+                    resolvedTypes[typeId] = tuple(functype["refs"])
+            functypetuple = resolvedTypes[typeId]
+            if functypetuple is not None and functypetuple in funcsbytype:
                 funcCandidates = [{"id": x["id"]}
                                   for x in funcsbytype[functypetuple]]
                 output.setdefault(func["id"], {})
@@ -298,6 +313,36 @@ class Deps:
 
     # -------------------------------------------------------------------------
 
+    # Resolve the struct member called through a pointer (see _infer_functions).
+    # Returns a tuple ((struct type id, member id), function type refs), where the refs
+    # are None for a void * member, or None if the member cannot be resolved.
+    def _resolve_member_call(self, memberKey, deref, func):
+        typemap = self.dbops.typemap
+        typeId, memberId = memberKey
+        structType = typemap[typeId]
+        while structType["class"] == "pointer" or structType["class"] == "typedef":
+            structType = typemap[structType["refs"][0]]
+
+        if memberId >= len(structType["refs"]):
+            return None
+
+        functype = typemap[structType["refs"][memberId]]
+        while functype["class"] == "pointer" or functype["class"] == "typedef" or functype["class"] == "const_array":
+            functype = typemap[functype["refs"][0]]
+        if functype["class"] == "function":
+            return (structType["id"], memberId), tuple(functype["refs"])
+        elif functype["str"] == "void":
+            return (structType["id"], memberId), None
+        else:
+            logging.error(f"Unsupported case found!")
+            logging.error(f">>> functype: {functype}")
+            logging.error(f">>> func: {func['name']}")
+            logging.error(f">>> deref: {deref}")
+            logging.error("Tracing function pointer calls")
+            return None
+
+    # -------------------------------------------------------------------------
+
     # @belongs: deps
     def _discover_known_functions(self, functions):
         for f_id in functions:
@@ -347,7 +392,9 @@ class Deps:
                 continue
 
             if t["class"] != "record":
-                h = hash(t["def"])
+                # a deterministic digest (unlike hash()), so that the duplicates
+                # are found in the same order in every process
+                h = hashlib.blake2b(t["def"].encode("utf-8"), digest_size=16).digest()
 
                 # these are not strictly duplicates, but we also need to have a special handler for
                 # a case in which a single typedef with a new type definition has several names like:
@@ -406,6 +453,31 @@ class Deps:
             f"Discovered {cnt} identical typedefs, dict size is {len(self.identical_typedefs)}")
 
         logging.info("Done, found {} dups".format(len(self.dup_types)))
+        self.set_type_canonical(self._create_type_canonical())
+
+    # -------------------------------------------------------------------------
+
+    # create an array: type id -> the lowest id among the type's duplicates;
+    # the array covers the ids up to the highest id with duplicates
+    def _create_type_canonical(self):
+        size = max(self.dup_types) + 1 if len(self.dup_types) > 0 else 0
+        canonical = np.arange(size, dtype=np.int64)
+        for tid, dups in self.dup_types.items():
+            canonical[tid] = min(dups)
+        return canonical
+
+    def set_type_canonical(self, canonical):
+        self.type_canonical = canonical
+        counts = np.bincount(canonical, minlength=canonical.size)
+        self.type_is_dup = counts[canonical] > 1
+
+    # returns a tuple of arrays: (type ids, ids of their representatives)
+    def _get_canonical_type_ids(self, types):
+        ids = np.fromiter(types, dtype=np.int64, count=len(types))
+        canonical = ids.copy()
+        inside = (ids >= 0) & (ids < self.type_canonical.size)
+        canonical[inside] = self.type_canonical[ids[inside]]
+        return ids, canonical
 
     # -------------------------------------------------------------------------
 
@@ -414,12 +486,18 @@ class Deps:
     # it comes directly from the "decls" field.
     # @belongs: deps
     def discover_internal_types(self):
+        self.internal_types = self._get_internal_types(self.args.used_types_only)
 
+    # @used_types_only: if True, use "usedrefs" rather than "refs" for records
+    # (see the --used-types-only option)
+    # @belongs: deps
+    def _get_internal_types(self, used_types_only):
+        internal_types = {}
         for t in self.dbops.db["types"]:
 
             if "decls" in t and len(t["decls"]) > 0:
                 for i in t["decls"]:
-                    if self.args.used_types_only and t["class"] == "record":
+                    if used_types_only and t["class"] == "record":
                         dst_tid = t["usedrefs"][i]
                     else:
                         dst_tid = t["refs"][i]
@@ -427,10 +505,12 @@ class Deps:
                     if -1 == dst_tid:
                         continue
                     tid = t["id"]
-                    if dst_tid not in self.internal_types:
-                        self.internal_types[dst_tid] = set()
+                    if dst_tid not in internal_types:
+                        internal_types[dst_tid] = set()
 
-                    self.internal_types[dst_tid].add(tid)
+                    internal_types[dst_tid].add(tid)
+
+        return internal_types
 
     # -------------------------------------------------------------------------
 
@@ -712,31 +792,54 @@ class Deps:
 
     # -------------------------------------------------------------------------
 
+    # create an inverted index: id -> the set of ids of the files using it;
+    # only the @ids we ask about are indexed
+    # @field: the File attribute with the ids (types, globals or funcs)
+    @staticmethod
+    def _get_files_index(files, field, ids):
+        index = {}
+        for fid, file in files.items():
+            for id in getattr(file, field):
+                if id in ids:
+                    if id not in index:
+                        index[id] = set()
+                    index[id].add(fid)
+        return index
+
+    # -------------------------------------------------------------------------
+
     # @belongs: otgenerator or deps -> deps more likely
     def _find_clashes(self, files, type_clashes, global_clashes, function_clashes, func_glob_clashes):
+        clashing_types = set()
+        for t_id1, t_id2 in type_clashes:
+            clashing_types.add(t_id1)
+            clashing_types.add(t_id2)
+        clashing_globals = set()
+        for g_id1, g_id2 in global_clashes:
+            clashing_globals.add(g_id1)
+            clashing_globals.add(g_id2)
+        clashing_funcs = set()
+        for f_id1, f_id2 in function_clashes:
+            clashing_funcs.add(f_id1)
+            clashing_funcs.add(f_id2)
+        for f_id, g_id in func_glob_clashes:
+            clashing_funcs.add(f_id)
+            clashing_globals.add(g_id)
+
+        # for each id find the files it's used in
+        type_files = Deps._get_files_index(files, "types", clashing_types)
+        glob_files = Deps._get_files_index(files, "globals", clashing_globals)
+        func_files = Deps._get_files_index(files, "funcs", clashing_funcs)
+        no_files = set()
+
         for tid_tuple in type_clashes:
             t_id1 = tid_tuple[0]
             t_id2 = tid_tuple[1]
 
-            if t_id1 not in self.type_clash_nums and t_id2 not in self.type_clash_nums:
-                self.type_clash_nums[t_id1] = self.type_clash_counter
-                self.type_clash_nums[t_id2] = self.type_clash_counter
-                self.type_clash_counter += 1
-            elif t_id2 not in self.type_clash_nums:
-                self.type_clash_nums[t_id2] = self.type_clash_nums[t_id1]
-            else:
-                self.type_clash_nums[t_id1] = self.type_clash_nums[t_id2]
-
-            # for each t_id find the files it's used in
-
-            tid1_files = set()
-            tid2_files = set()
+            self.type_clash_groups.union(t_id1, t_id2)
 
-            for fid, file in files.items():
-                if t_id1 in file.types:
-                    tid1_files.add(fid)
-                if t_id2 in file.types:
-                    tid2_files.add(fid)
+            tid1_files = type_files.get(t_id1, no_files)
+            tid2_files = type_files.get(t_id2, no_files)
 
             if tid1_files == tid2_files:
                 # both types are used in exactly the same files -> no need to create
@@ -754,23 +857,10 @@ class Deps:
             g_id1 = gid_tuple[0]
             g_id2 = gid_tuple[1]
 
-            if g_id1 not in self.glob_clash_nums and g_id2 not in self.glob_clash_nums:
-                self.glob_clash_nums[g_id1] = self.glob_clash_counter
-                self.glob_clash_nums[g_id2] = self.glob_clash_counter
-                self.glob_clash_counter += 1
-            elif g_id2 not in self.glob_clash_nums:
-                self.glob_clash_nums[g_id2] = self.glob_clash_nums[g_id1]
-            else:
-                self.glob_clash_nums[g_id1] = self.glob_clash_nums[g_id2]
-
-            gid1_files = set()
-            gid2_files = set()
+            self.glob_clash_groups.union(g_id1, g_id2)
 
-            for fid, file in files.items():
-                if g_id1 in file.globals:
-                    gid1_files.add(fid)
-                if g_id2 in file.globals:
-                    gid2_files.add(fid)
+            gid1_files = glob_files.get(g_id1, no_files)
+            gid2_files = glob_files.get(g_id2, no_files)
 
             if gid1_files == gid2_files:
                 # both globals are used in exactly the same files -> no need to create
@@ -788,23 +878,10 @@ class Deps:
             f_id1 = fid_tuple[0]
             f_id2 = fid_tuple[1]
 
-            if f_id1 not in self.func_clash_nums and f_id2 not in self.func_clash_nums:
-                self.func_clash_nums[f_id1] = self.func_clash_counter
-                self.func_clash_nums[f_id2] = self.func_clash_counter
-                self.func_clash_counter += 1
-            elif f_id2 not in self.func_clash_nums:
-                self.func_clash_nums[f_id2] = self.func_clash_nums[f_id1]
-            else:
-                self.func_clash_nums[f_id1] = self.func_clash_nums[f_id2]
-
-            fid1_files = set()
-            fid2_files = set()
+            self.func_clash_groups.union(f_id1, f_id2)
 
-            for fid, file in files.items():
-                if f_id1 in file.funcs:
-                    fid1_files.add(fid)
-                if f_id2 in file.funcs:
-                    fid2_files.add(fid)
+            fid1_files = func_files.get(f_id1, no_files)
+            fid2_files = func_files.get(f_id2, no_files)
 
             if fid1_files == fid2_files:
                 # both globals are used in exactly the same files -> no need to create
@@ -829,21 +906,16 @@ class Deps:
             f_id = tuple[0]
             g_id = tuple[1]
 
-            if f_id not in self.func_clash_nums:
-                self.func_clash_nums[f_id] = self.func_clash_counter
-                self.func_clash_counter += 1
-            if g_id not in self.glob_clash_nums:
-                self.glob_clash_nums[g_id] = self.glob_clash_counter
-                self.glob_clash_counter += 1
+            self.func_clash_groups.add(f_id)
+            self.glob_clash_groups.add(g_id)
 
             fid_files = set()
             gid_files = set()
 
-            for fid, file in files.items():
-                if f_id in file.funcs:
-                    fid_files.add(f_id)
-                if g_id in file.globals:
-                    gid_files.add(g_id)
+            if f_id in func_files:
+                fid_files.add(f_id)
+            if g_id in glob_files:
+                gid_files.add(g_id)
 
             if fid_files == gid_files:
                 continue
@@ -855,6 +927,13 @@ class Deps:
                 self.clash_global_to_file[g_id] = set()
             self.clash_global_to_file[g_id] = fid_files
 
+        self.type_clash_nums = self.type_clash_groups.get_nums()
+        self.type_clash_counter = self.type_clash_groups.counter
+        self.glob_clash_nums = self.glob_clash_groups.get_nums()
+        self.glob_clash_counter = self.glob_clash_groups.counter
+        self.func_clash_nums = self.func_clash_groups.get_nums()
+        self.func_clash_counter = self.func_clash_groups.counter
+
     # -------------------------------------------------------------------------
 
     # @belongs: codegen or deps
@@ -958,22 +1037,23 @@ class Deps:
 
     # -------------------------------------------------------------------------
 
+    # remove the duplicates of the types: the first type (in the iteration order) of
+    # each class of duplicates is kept; if @all is True all the types with duplicates
+    # are removed
     # @belonds: deps?
     def _remove_duplicated_types(self, types, all=False):
-        to_remove = []
-        for t in types:
-            if t in to_remove:
-                continue
-            if t in self.dup_types:
-                dups = self.dup_types[t]
-                for d in dups:
-                    if d == t:
-                        continue
-                    if d in types:
-                        to_remove.append(d)
-                if all == True:
-                    to_remove.append(t)
-        for t in to_remove:
+        if len(types) == 0:
+            return types
+        ids, canonical = self._get_canonical_type_ids(types)
+        if all == True:
+            inside = (ids >= 0) & (ids < self.type_is_dup.size)
+            is_dup = np.zeros(ids.size, dtype=bool)
+            is_dup[inside] = self.type_is_dup[ids[inside]]
+            to_remove = ids[is_dup]
+        else:
+            _, first, inverse = np.unique(canonical, return_index=True, return_inverse=True)
+            to_remove = ids[ids != ids[first][inverse]]
+        for t in to_remove.tolist():
             types.remove(t)
 
         return types
@@ -982,23 +1062,12 @@ class Deps:
     # from the _from array
     # @belongs: deps?
     def _remove_duplicated_types_from(self, _base, _from):
-        for t in _base:
-            if t in _from:
-                _from.remove(t)
-
-            if t in self.dup_types:
-                dups = self.dup_types[t]
-                # we need to check if any of the duplicates is present
-                # in the _base array
-                present = False
-                for d in dups:
-                    if d in _base:
-                        present = True
-                        break
-                if present:
-                    for d in dups:
-                        if d in _from:
-                            _from.remove(d)
+        if len(_base) == 0 or len(_from) == 0:
+            return _from
+        _, base_canonical = self._get_canonical_type_ids(_base)
+        ids, canonical = self._get_canonical_type_ids(_from)
+        for t in ids[np.isin(canonical, base_canonical)].tolist():
+            _from.remove(t)
         return _from
 
     # -------------------------------------------------------------------------
@@ -1074,10 +1143,15 @@ class Deps:
         del all_types_data
         logging.debug("Toposort types")
 
-        circles = True
+        # the deps are the sets cached in deps_cache, so the dependencies broken (or
+        # added) below are kept for the subsequent calls; once the deps have no
+        # cycles they usually agree with the type levels found by the previous
+        # calls and we can sort them without toposort
+        sorted_ids = self._sort_types_by_level(deps)
+        circles = sorted_ids is None
         while circles:
             try:
-                sorted = toposort_flatten(deps)
+                sorted_ids = list(toposort_flatten(deps))
                 circles = False
             except CircularDependencyError as e:
                 logging.warning("Circular depdencies detected")
@@ -1123,23 +1197,72 @@ class Deps:
 
                 logging.info("Retry toposort after circle removal")
                 #sorted = toposort_flatten(deps)
-                
-        sorted_types = self.dbops.typemap.get_many(list(sorted))
-        sorted = [t["id"] for t in sorted_types if t["class"] != "builtin"
-                  and t["id"] not in _internal_defs]
-        logging.debug("sorted is {}".format(sorted))
+            if not circles:
+                self._update_type_level(sorted_ids, deps)
+
+        sorted_types = self.dbops.typemap.get_many(sorted_ids)
+        sorted_ids = [t["id"] for t in sorted_types if t["class"] != "builtin"
+                      and t["id"] not in _internal_defs]
+        logging.debug("sorted is {}".format(sorted_ids))
 
         del sorted_types
 
         # adding type deps might have added types that we don't want to have
         # those are defined in base_types and need to be filtered out
         if base_types is not None:
-            sorted = [t for t in sorted if t not in base_types]
+            sorted_ids = [t for t in sorted_ids if t not in base_types]
 
         if None != internal_defs:
             internal_defs |= _internal_defs
 
-        return sorted, deps
+        return sorted_ids, deps
+
+    # -------------------------------------------------------------------------
+
+    # sort the types in deps (and their dependencies) in the same order as
+    # toposort_flatten does: by the toposort level and then by id;
+    # returns None if any of the types has no level yet or if the deps
+    # do not agree with the levels
+    def _sort_types_by_level(self, deps):
+        level = self.type_level
+        types = set(deps)
+        for tid, refs in deps.items():
+            tid_level = level.get(tid)
+            if tid_level is None:
+                return None
+            # the level is one more than the highest level of the deps;
+            # the types which are only referenced have level 0
+            expected = 0
+            for ref in refs:
+                if ref == tid:
+                    continue
+                if ref in deps:
+                    ref_level = level.get(ref)
+                    if ref_level is None:
+                        return None
+                    expected = max(expected, ref_level + 1)
+                else:
+                    expected = max(expected, 1)
+            if expected != tid_level:
+                return None
+            types |= refs
+        return sorted(types, key=lambda t: (level[t] if t in deps else 0, t))
+
+    # -------------------------------------------------------------------------
+
+    # store the levels of the types in deps; @sorted_ids is the toposort of deps,
+    # so the deps of each type get their levels first
+    def _update_type_level(self, sorted_ids, deps):
+        level = self.type_level
+        for tid in sorted_ids:
+            if tid not in deps:
+                continue
+            tid_level = 0
+            for ref in deps[tid]:
+                if ref == tid:
+                    continue
+                tid_level = max(tid_level, level[ref] + 1 if ref in deps else 1)
+            level[tid] = tid_level
 
     # -------------------------------------------------------------------------
 
@@ -1201,72 +1324,65 @@ class Deps:
     def _get_called_functions(self, functions, additional_refs=None, filter_on=True, discover_known=False, calls_only=False):
         fcalls = set()
 
+        if filter_on:
+            cutoff = set(self.dbops.known_funcs_ids)
+            logging.info(f"Will use {len(cutoff)} known ids")
+            if 0 == len(cutoff):
+                cutoff = None
+        else:
+            cutoff = None
+
+        if not self.args.include_asm:
+            if cutoff is None:
+                cutoff = set()
+            # if we don't want to include assembly, we can cut the serach short
+            # whenever a function with inline asm is encountered
+            cutoff |= self.dbops.all_funcs_with_asm
+
+        if cutoff is not None:
+            # the same cut-off set is used for all the queries below; as a frozenset
+            # its hash is computed only once when used in the recursive query cache key
+            cutoff = frozenset(cutoff)
+
         # please note that we use "funrefs" here
         # this is because "funrefs" is a superset of "calls" in db.json
         # the "funrefs" array contains all references to functions inside a function;
         # that can be: a call and use by name (e.g. in function pointers)
-        for f in functions:
-            if f in fcalls:
-                # if the id is already in the results set, there is no need to
-                # query as the query is always recursive
-                continue
-            else:
-                if filter_on:
-                    cutoff = set(self.dbops.known_funcs_ids)
-                    logging.info(f"Will use {len(cutoff)} known ids")
-                    if 0 == len(cutoff):
-                        cutoff = None
-                else:
-                    cutoff = None
-
-                if not self.args.include_asm:
-                    if cutoff is None:
-                        cutoff = set()
-                    # if we don't want to include assembly, we can cut the serach short
-                    # whenever a function with inline asm is encountered
-                    cutoff |= self.dbops.all_funcs_with_asm
-
-                logging.debug("fcalls size is {}".format(len(fcalls)))
-
-            used_map_name = 'funcs_tree_'
-            used_map_name += 'calls' if calls_only else 'funrefs'
-            if cutoff:
-                if filter_on:
-                    used_map_name += '_no_known'
-                if not self.args.include_asm or not filter_on:
-                    used_map_name += '_no_asm'
-            logging.debug("selecting cache matrix based on:")
-            logging.debug(" calls_only - {}; cutoff - {}; filter_on - {}; include_asm {}".format(
-                calls_only, cutoff, filter_on, self.args.include_asm))
-            used_map = self.dbops.get_cache_matrix(used_map_name)
-
-            # collect list of accesible functions
-            if used_map is not None:
-                if additional_refs is None:
-                    result = []
-                    # if f in used_map:
-                    # result = used_map[f]["funrefs"]
-                    result = self.dbops._graph_dfs(used_map, f)
-                    if f not in result:
-                        result.append(f)
-                else:
-                    tmp = set()
-                    for f_id in additional_refs:
-                        tmp |= set(self.dbops._graph_dfs(used_map, f_id))
-                        # if f_id in used_map:
-                        #    tmp |= set(used_map[f_id]["funrefs"])
-                        tmp.add(f_id)
-                    # tmp |= set(used_map[f]["funrefs"])
-                    tmp |= set(self.dbops._graph_dfs(used_map, f))
-
-                    tmp.add(f)
-
-                    result = list(tmp)
+        used_map_name = 'funcs_tree_'
+        used_map_name += 'calls' if calls_only else 'funrefs'
+        if cutoff:
+            if filter_on:
+                used_map_name += '_no_known'
+            if not self.args.include_asm or not filter_on:
+                used_map_name += '_no_asm'
+        logging.debug("selecting cache matrix based on:")
+        logging.debug(" calls_only - {}; cutoff size - {}; filter_on - {}; include_asm {}".format(
+            calls_only, len(cutoff) if cutoff else 0, filter_on, self.args.include_asm))
+        used_map = self.dbops.get_cache_matrix(used_map_name)
+
+        # collect list of accesible functions
+        if used_map is not None:
+            if len(functions) > 0:
+                # a single traversal from all the functions and the additional refs
+                seeds = list(functions)
+                if additional_refs is not None:
+                    seeds.extend(additional_refs)
+                condensation = self.dbops.get_cache_condensation(used_map_name)
+                fcalls = set(self.dbops._condensation_reachable(
+                    condensation, seeds).tolist())
+        else:
+            if not calls_only:
+                field = "funrefs"
             else:
-                if not calls_only:
-                    field = "funrefs"
+                field = "calls"
+
+            for f in functions:
+                if f in fcalls:
+                    # if the id is already in the results set, there is no need to
+                    # query as the query is always recursive
+                    continue
                 else:
-                    field = "calls"
+                    logging.debug("fcalls size is {}".format(len(fcalls)))
 
                 result = self.db.make_recursive_query(
                     "funcs",
@@ -1277,8 +1393,8 @@ class Deps:
                     value_to_return="id",
                     add_vals=additional_refs,
                     cutoff_list=cutoff)
-            for r in result:
-                fcalls.add(r)
+                for r in result:
+                    fcalls.add(r)
 
         functions |= fcalls
 
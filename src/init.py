@@ -59,12 +59,16 @@ class Init:
         self.deps = deps
         self.codegen = codegen
         self.args = args
+        self.ptr_init_size = 1  # when initializing pointers use this a the number of objects
+        self.array_init_max_size = 32  # when initializing arrays use this a an upper limimit
+        self.reset()
+
+    # clear the state gathered while generating a single off-target
+    def reset(self):
         self.member_usage_info = {}
         self.casted_pointers = {}
         self.offset_pointers = {}
         self.trace_cache = {}
-        self.ptr_init_size = 1  # when initializing pointers use this a the number of objects
-        self.array_init_max_size = 32  # when initializing arrays use this a an upper limimit
         self.tagged_vars_count = 0
         self.fpointer_stubs = []
         self.stub_names = set()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+# Auto off-target PoC
+###
+# Copyright  Samsung Electronics
+# Samsung Mobile Security Team @ Samsung R&D Poland
+
+#
+# Incremental parsing of large JSON files (db.json, rdm.json)
+#
+
+import re
+import json
+
+
+# Incremental JSON parser: the values of the top-level object are decoded from
+# a buffer that is refilled from the file as needed; arrays are decoded element
+# by element so that the buffer only needs to hold a single element at a time
+class JsonStream:
+
+    CHUNK_SIZE = 16 * 1024 * 1024
+    WHITESPACE = re.compile(r"[ \t\n\r]*")
+    NUMBER_CHARS = "0123456789.eE+-"
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _read(self, size):
+        data = self.f.read(size)
+        if len(data) < size:
+            self.eof = True
+        # drop the data that was already parsed
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+
+    # return the next non-whitespace character ('' at the end of the file)
+    def _peek(self):
+        while True:
+            self.pos = JsonStream.WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.eof:
+                return ""
+            self._read(self.chunk_size)
+
+    def _expect(self, chars):
+        c = self._peek()
+        if c == "" or c not in chars:
+            raise ValueError(
+                f"Invalid JSON: expected one of '{chars}', got '{c}'")
+        self.pos += 1
+        return c
+
+    # decode a single JSON value
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+                # a number at the end of the buffer might continue in the file
+                if (end < len(self.buf) and self.buf[end] not in JsonStream.NUMBER_CHARS) or self.eof:
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # the value is incomplete - read at least as much as we already have
+            # so that long values are not decoded over and over again
+            self._read(max(self.chunk_size, len(self.buf) - self.pos))
+
+    # iterate over the (key, value) members of the top-level JSON object;
+    # each value is decoded as a whole
+    def iter_object(self):
+        self._expect("{")
+        if self._peek() == "}":
+            self.pos += 1
+            return
+
+        while True:
+            key = self._value()
+            self._expect(":")
+            yield key, self._value()
+            if self._expect(",}") == "}":
+                break
+
+    # parse the top-level JSON object and store its members in @data;
+    # the elements of array members are passed to the callables in @handlers[member name]
+    def load_object(self, data, handlers):
+        self._expect("{")
+        if self._peek() == "}":
+            self.pos += 1
+            return data
+
+        while True:
+            key = self._value()
+            self._expect(":")
+            if self._peek() == "[":
+                self.pos += 1
+                items = data.setdefault(key, [])
+                item_handlers = handlers.get(key, [])
+                if self._peek() == "]":
+                    self.pos += 1
+                else:
+                    while True:
+                        item = self._value()
+                        items.append(item)
+                        for handler in item_handlers:
+                            handler(item)
+                        if self._expect(",]") == "]":
+                            break
+            else:
+                data[key] = self._value()
+
+            if self._expect(",}") == "}":
+                break
+
+        return data
@@ -30,7 +30,13 @@ class OTGenerator:
         self.cutoff = cutoff
         self.init = init
         self.args = args
-        self.out_dir = args.output_dir
+        self.reset()
+
+    # clear the state gathered while generating a single off-target;
+    # the output directory is taken from args as it changes between targets
+    # in the batch mode
+    def reset(self):
+        self.out_dir = self.args.output_dir
         # mapping original location of a header to the generated header
         self.location_to_header = {}
         self.header_to_location = {}
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+# Auto off-target PoC
+# Copyright Samsung Electronics
+# Samsung Mobile Security Team @ Samsung R&D Poland
+
+# Tests of the remote BAS server client against a stub HTTP server
+
+import http.server
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import unittest
+import urllib.parse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from BASconnector import BASconnector, BASServerError  # noqa: E402
+
+MODULES = {
+    "/src/a.c": ["/out/a.o"],
+    "/src/b.c": ["/out/b.o", "/out/lib.a"],
+    "/src/c.c": ["/out/c.o"],
+}
+# the location for which the server sends a reply without the module entries
+MALFORMED = "/src/bad.c"
+
+
+class StubBASHandler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        locs = [v for k, v in urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query)
+                if k == "revdeps_for"]
+        server.requests.append(locs)
+        if server.error_status is not None:
+            self.send_response(server.error_status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if server.batch_supported and len(locs) > 1:
+            contents = {}
+            for loc in locs:
+                if loc == MALFORMED:
+                    contents[loc] = ["not", "a", "dict"]
+                elif loc in MODULES:
+                    contents[loc] = {"entries": MODULES[loc]}
+        else:
+            # an old server only looks at the first location
+            loc = locs[0]
+            if loc == MALFORMED:
+                contents = {"error": "malformed"}
+            else:
+                contents = {"entries": MODULES.get(loc, [])}
+        body = json.dumps(contents).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestBASconnector(unittest.TestCase):
+
+    @staticmethod
+    def _start_server():
+        server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubBASHandler)
+        server.requests = []
+        server.batch_supported = True
+        server.error_status = None
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.server = TestBASconnector._start_server()
+        self.cache_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.cache_dir.cleanup()
+        logging.disable(logging.NOTSET)
+
+    def _connector(self, cache_size=100000):
+        host, port = self.server.server_address
+        return BASconnector(f"http://{host}:{port}", cache_size=cache_size,
+                            cache_dir=self.cache_dir.name)
+
+    def test_batched_reply(self):
+        bas = self._connector()
+        locs = ["/src/a.c:10", "/src/b.c:1", "/src/a.c:20", MALFORMED, "/src/none.c"]
+        self.assertEqual(bas.get_modules_for_locations(locs),
+                         [MODULES["/src/a.c"], MODULES["/src/b.c"], MODULES["/src/a.c"], [], []])
+        # the unique locations are asked for in a single request
+        self.assertEqual(self.server.requests,
+                         [["/src/a.c", "/src/b.c", MALFORMED, "/src/none.c"]])
+        self.assertTrue(bas.batch_supported)
+
+    def test_per_location_fallback(self):
+        self.server.batch_supported = False
+        bas = self._connector()
+        locs = ["/src/a.c", MALFORMED, "/src/c.c"]
+        self.assertEqual(bas.get_modules_for_locations(locs),
+                         [MODULES["/src/a.c"], [], MODULES["/src/c.c"]])
+        self.assertFalse(bas.batch_supported)
+        self.assertEqual(self.server.requests,
+                         [locs, ["/src/a.c"], [MALFORMED], ["/src/c.c"]])
+        # further batches go straight to the per-location requests
+        self.server.requests.clear()
+        self.assertEqual(bas.get_modules_for_locations(["/src/b.c", "/src/none.c"]),
+                         [MODULES["/src/b.c"], []])
+        self.assertEqual(self.server.requests, [["/src/b.c"], ["/src/none.c"]])
+
+    def test_disk_cache(self):
+        locs = ["/src/a.c", "/src/b.c", MALFORMED]
+        expected = [MODULES["/src/a.c"], MODULES["/src/b.c"], []]
+        self.assertEqual(self._connector().get_modules_for_locations(locs), expected)
+        self.assertEqual(len(self.server.requests), 1)
+
+        # a new client answers the found locations from the cache file
+        self.server.requests.clear()
+        bas = self._connector()
+        self.assertEqual(bas.get_modules_for_locations(locs), expected)
+        self.assertEqual(self.server.requests, [[MALFORMED]])
+
+    def test_disk_cache_without_memory_cache(self):
+        self._connector().get_modules_for_locations(["/src/a.c", "/src/b.c"])
+        bas = self._connector(cache_size=0)
+        loads = []
+        load_cache_file = bas._load_cache_file
+        bas._load_cache_file = lambda: loads.append(1) or load_cache_file()
+        for _ in range(3):
+            bas.get_modules_for_locations(["/src/c.c"])
+        # the cache file is read once even though nothing is kept in memory
+        self.assertEqual(len(loads), 1)
+
+    def test_disk_cache_size(self):
+        locs = ["/src/a.c", "/src/b.c", "/src/c.c"]
+        self._connector().get_modules_for_locations(locs)
+        # the disk cache is used whatever the size of the memory cache
+        for cache_size in (0, 1):
+            self.server.requests.clear()
+            bas = self._connector(cache_size=cache_size)
+            for _ in range(2):
+                self.assertEqual(bas.get_modules_for_locations(locs), [MODULES[loc] for loc in locs])
+            self.assertEqual(self.server.requests, [])
+        with open(bas.cache_file, "r") as f:
+            self.assertEqual(len(f.readlines()), len(locs))
+
+    def test_disk_cache_per_server(self):
+        self._connector().get_modules_for_locations(["/src/a.c"])
+        other = TestBASconnector._start_server()
+        try:
+            host, port = other.server_address
+            bas = BASconnector(f"http://{host}:{port}", cache_dir=self.cache_dir.name)
+            bas.get_modules_for_locations(["/src/a.c"])
+            # the answers of the first server are not used for the other one
+            self.assertEqual(other.requests, [["/src/a.c"]])
+        finally:
+            other.shutdown()
+            other.server_close()
+        self.assertEqual(len(os.listdir(self.cache_dir.name)), 2)
+
+    def test_server_error(self):
+        bas = self._connector()
+        self.assertEqual(bas.get_modules_for_locations(["/src/a.c"]), [MODULES["/src/a.c"]])
+        self.server.error_status = 500
+        # a failed lookup is reported rather than returned as a location without modules
+        for _ in range(2):
+            with self.assertRaises(BASServerError):
+                bas.get_modules_for_locations(["/src/b.c", "/src/c.c"])
+        # the locations fetched before the failure are still answered from the cache
+        self.assertEqual(bas.get_modules_for_locations(["/src/a.c"]), [MODULES["/src/a.c"]])
+        self.server.error_status = None
+        self.server.requests.clear()
+        self.assertEqual(bas.get_modules_for_locations(["/src/b.c", "/src/c.c"]),
+                         [MODULES["/src/b.c"], MODULES["/src/c.c"]])
+        # the failure did not switch off the batched requests
+        self.assertEqual(self.server.requests, [["/src/b.c", "/src/c.c"]])
+
+    def test_unreachable_server(self):
+        host, port = self.server.server_address
+        self.server.shutdown()
+        self.server.server_close()
+        bas = BASconnector(f"http://{host}:{port}", cache_dir=self.cache_dir.name)
+        for _ in range(2):
+            with self.assertRaises(OSError):
+                bas.get_modules_for_locations(["/src/a.c", "/src/b.c"])
+        self.assertEqual(os.listdir(self.cache_dir.name), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
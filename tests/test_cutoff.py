@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+# Auto off-target PoC
+# Copyright Samsung Electronics
+# Samsung Mobile Security Team @ Samsung R&D Poland
+
+# Tests of the cut-off cache file stored next to the db file
+
+import json
+import logging
+import os
+import sys
+import tempfile
+import types
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from cutoff import CutOff  # noqa: E402
+
+
+class StubDbOps:
+
+    def _get_function_file(self, fid):
+        return f"/src/dir{fid}/f{fid}.c", f"/src/dir{fid}/f{fid}.c:1", []
+
+
+class StubBASconnector:
+
+    remote = True
+    url = "http://bas/"
+
+    def __init__(self):
+        self.failed = False
+
+    def get_modules_for_locations(self, locations):
+        if self.failed:
+            raise OSError("BAS server is not reachable")
+        return [[f"/out/{os.path.basename(loc.split(':')[0])}.o"] for loc in locations]
+
+
+class TestCutOffCache(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db = os.path.join(self.tmp_dir.name, "db.img")
+        with open(self.db, "wb") as f:
+            f.write(b"db image")
+        self.cache_file = os.path.join(self.tmp_dir.name, "db_cutoff.json")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+        logging.disable(logging.NOTSET)
+
+    def _cutoff(self, basconnector=None):
+        args = types.SimpleNamespace(db=self.db, co_funcs=[], co_dirs=[], co_modules=[], co_files=[],
+                                     func_stats=CutOff.FUNC_STATS_BASIC, include_asm=False)
+        return CutOff(StubDbOps(), args, basconnector or StubBASconnector(), None)
+
+    def _load_cache_file(self):
+        with open(self.cache_file, "r") as f:
+            return json.load(f)
+
+    def test_failed_lookup_not_stored(self):
+        cutoff = self._cutoff()
+        cutoff._get_mods_and_dirs_for_funcs([1, 2])
+        cutoff._store_cache()
+
+        basconnector = StubBASconnector()
+        basconnector.failed = True
+        cutoff = self._cutoff(basconnector)
+        with self.assertRaises(OSError):
+            cutoff._get_mods_and_dirs_for_funcs([2, 3])
+        self.assertNotIn(3, cutoff.fid_to_dirs)
+        self.assertNotIn(3, cutoff.fid_to_mods)
+        cutoff._store_cache()
+
+        # the functions of the failed lookup are looked up again in the next run
+        cache = self._load_cache_file()
+        self.assertEqual(sorted(cache["fid_to_dirs"]), ["1", "2"])
+        cutoff = self._cutoff()
+        cutoff._get_mods_and_dirs_for_funcs([2, 3])
+        self.assertEqual(cutoff.fid_to_mods[3], ["/out/f3.c.o"])
+
+    def test_concurrent_stores_merged(self):
+        # e.g. the --jobs workers classifying different functions: all of them
+        # load the cache file before any of them stores it
+        cutoffs = []
+        for fids in ([1, 2], [3], [2, 4]):
+            cutoff = self._cutoff()
+            cutoff._get_mods_and_dirs_for_funcs(fids)
+            cutoff.stats_cache[fids[0]] = set(fids)
+            cutoffs.append(cutoff)
+        for cutoff in cutoffs:
+            cutoff._store_cache()
+
+        cache = self._load_cache_file()
+        self.assertEqual(sorted(cache["fid_to_dirs"]), ["1", "2", "3", "4"])
+        self.assertEqual(sorted(cache["fid_to_mods"]), ["1", "2", "3", "4"])
+        self.assertEqual(sorted(cache["stats_cache"][f"{CutOff.FUNC_STATS_BASIC}_False"]),
+                         ["1", "2", "3"])
+
+        # nothing is looked up again in the next run
+        basconnector = StubBASconnector()
+        basconnector.failed = True
+        cutoff = self._cutoff(basconnector)
+        cutoff._get_mods_and_dirs_for_funcs([1, 2, 3, 4])
+        self.assertEqual(cutoff.fid_to_mods[4], ["/out/f4.c.o"])
+        self.assertEqual(cutoff.fid_to_dirs[4], {"/src/dir4"})
+
+
+if __name__ == "__main__":
+    unittest.main()